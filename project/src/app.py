@@ -2,7 +2,9 @@
 # Streamlit UI to browse Snowflake translation pipeline outputs and run the pipeline.
 # Works even if there's no prior output — shows a Getting Started panel.
 
+import os
 import json
+import math
 import traceback
 from pathlib import Path
 import pandas as pd
@@ -24,6 +26,9 @@ STAGES = {
     "translator_pass2": OUTPUT / "translator_pass2",
 }
 
+# Part files listed per page in the Parts & Index tab
+PARTS_PAGE_SIZE = 50
+
 # ---------- Small utils ----------
 def ensure_dirs():
     INPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -32,45 +37,135 @@ def ensure_dirs():
     for p in STAGES.values():
         p.mkdir(parents=True, exist_ok=True)
 
+def _dir_mtime(d: Path) -> float:
+    try:
+        return d.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
 def list_bases() -> list[str]:
+    # A directory's mtime changes when entries are added/removed, so it is a
+    # sufficient cache key for the set of bases.
+    return _list_bases_cached(_dir_mtime(FINAL_DIR), _dir_mtime(STAGES["splitter"]))
+
+@st.cache_data(show_spinner=False)
+def _list_bases_cached(final_mtime: float, splitter_mtime: float) -> list[str]:
     bases = set()
+    # One scandir per directory; DirEntry type checks reuse the readdir data
     if FINAL_DIR.exists():
-        for p in FINAL_DIR.glob("*_snowflake.sql"):
-            bases.add(p.stem.replace("_snowflake", ""))
-        for p in FINAL_DIR.iterdir():
-            if p.is_dir():
-                bases.add(p.name)
+        with os.scandir(FINAL_DIR) as it:
+            for e in it:
+                if e.is_dir():
+                    bases.add(e.name)
+                elif e.name.endswith("_snowflake.sql") and e.is_file():
+                    bases.add(e.name[:-len("_snowflake.sql")])
     sp = STAGES["splitter"]
     if sp.exists():
-        for d in sp.iterdir():
-            if d.is_dir():
-                bases.add(d.name)
+        with os.scandir(sp) as it:
+            for e in it:
+                if e.is_dir():
+                    bases.add(e.name)
     return sorted(b for b in bases if b.strip())
 
+# Streamlit reruns the whole script on every widget change; serve unchanged
+# files from memory. mtime + size are part of the key so edits invalidate.
+@st.cache_data(show_spinner=False)
+def _read_text_cached(path_str: str, mtime: float, size: int) -> str:
+    return Path(path_str).read_text(encoding="utf-8", errors="ignore")
+
+@st.cache_data(show_spinner=False)
+def _read_json_cached(path_str: str, mtime: float, size: int):
+    return json.loads(Path(path_str).read_text(encoding="utf-8"))
+
 def read_text(p: Path) -> str | None:
     try:
         if p.exists():
-            return p.read_text(encoding="utf-8", errors="ignore")
+            stat = p.stat()
+            return _read_text_cached(p.as_posix(), stat.st_mtime, stat.st_size)
         return None
     except Exception:
         return f"-- Error reading file: {p}\n-- {traceback.format_exc()}"
 
+def _st_read(p: Path) -> str | None:
+    """read_text with a per-session copy: cache_data hits still unpickle the whole
+    string, so the big final/doc/notx files are kept in session_state by (mtime, size)."""
+    key = ("rt", p.as_posix())
+    try:
+        stat = p.stat()
+        sig = (stat.st_mtime, stat.st_size)
+    except FileNotFoundError:
+        st.session_state.pop(key, None)
+        return None
+    hit = st.session_state.get(key)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    val = read_text(p)
+    st.session_state[key] = (sig, val)
+    return val
+
 def read_json(p: Path):
     try:
         if p.exists():
-            return json.loads(p.read_text(encoding="utf-8"))
+            stat = p.stat()
+            return _read_json_cached(p.as_posix(), stat.st_mtime, stat.st_size)
         return None
     except Exception:
         return {"__error__": f"Failed to parse JSON at {p.as_posix()}"}
 
+def _tail(p: Path, n: int = 2000) -> str:
+    """Read only the last n bytes of a (possibly large) file."""
+    try:
+        with p.open("rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - n))
+            return f.read().decode("utf-8", "ignore")
+    except Exception:
+        return f"-- Error reading file: {p}\n-- {traceback.format_exc()}"
+
 def list_stage_files(stage_root: Path, base: str) -> list[Path]:
-    d = stage_root / base
-    if not d.exists():
+    out: list[Path] = []
+    stack = [stage_root / base]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except FileNotFoundError:
+            continue
+        with it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(Path(e.path))
+                elif e.is_file(follow_symlinks=False):
+                    out.append(Path(e.path))
+    return sorted(out)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _list_part_names(dir_str: str, dir_mtime: float) -> list[str]:
+    try:
+        with os.scandir(dir_str) as it:
+            names = [e.name for e in it
+                     if e.name.startswith("part_") and e.name.endswith(".sql") and e.is_file()]
+    except FileNotFoundError:
         return []
-    return sorted([p for p in d.rglob("*") if p.is_file()])
+    return sorted(names)
 
-def download_button(label: str, filepath: Path, mime: str = "text/plain"):
-    content = read_text(filepath)
+def show_part_names(d: Path, key: str):
+    """Render part file names one page at a time (scripts can split into thousands of parts)."""
+    names = _list_part_names(d.as_posix(), _dir_mtime(d))
+    if not names:
+        return
+    pages = math.ceil(len(names) / PARTS_PAGE_SIZE)
+    page = 1
+    if pages > 1:
+        page = int(st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=key))
+    visible = names[(page - 1) * PARTS_PAGE_SIZE:page * PARTS_PAGE_SIZE]
+    with st.expander(f"{len(names)} file(s)", expanded=True):
+        st.markdown("\n".join(f"- {n}" for n in visible))
+
+def download_button(label: str, filepath: Path, mime: str = "text/plain", content: str | None = None):
+    if content is None:
+        content = read_text(filepath)
     if content is None:
         st.caption(f"Not found: {filepath.as_posix()}")
         return
@@ -254,34 +349,34 @@ tab_final, tab_doc, tab_notx, tab_parts, tab_stages, tab_diag = st.tabs(
 with tab_final:
     final_sql_path = FINAL_DIR / f"{base}_snowflake.sql"
     st.subheader("Clean deployable SQL")
-    txt = read_text(final_sql_path)
+    txt = _st_read(final_sql_path)
     if txt is None:
         st.warning("Final SQL not found.")
     else:
         st.code(txt, language="sql")
-        download_button("Download final SQL", final_sql_path, mime="text/sql")
+        download_button("Download final SQL", final_sql_path, mime="text/sql", content=txt)
 
 # --- Documented (Explain) ---
 with tab_doc:
     doc_path = FINAL_DIR / base / "explain_summary.sql"
     st.subheader("Documented version (summary, citations, TODOs)")
-    txt = read_text(doc_path)
+    txt = _st_read(doc_path)
     if txt is None:
         st.info("No documented file found (this is optional).")
     else:
         st.code(txt, language="sql")
-        download_button("Download documented SQL", doc_path, mime="text/sql")
+        download_button("Download documented SQL", doc_path, mime="text/sql", content=txt)
 
 # --- Not Translated ---
 with tab_notx:
     notx_path = FINAL_DIR / base / "not_translated.sql"
     st.subheader("Skipped blocks (admin/metadata/unknown)")
-    txt = read_text(notx_path)
+    txt = _st_read(notx_path)
     if txt is None:
         st.info("No not_translated file found.")
     else:
         st.code(txt, language="sql")
-        download_button("Download not_translated.sql", notx_path, mime="text/sql")
+        download_button("Download not_translated.sql", notx_path, mime="text/sql", content=txt)
 
 # --- Parts & Index (from splitter) ---
 with tab_parts:
@@ -290,26 +385,31 @@ with tab_parts:
     if not parts_index:
         st.info("No parts.json found under splitter.")
     else:
-        t_count = sum(1 for p in parts_index if p.get("category") == "translate")
-        d_count = sum(1 for p in parts_index if p.get("category") != "translate")
+        # Single pass: count categories and collect display rows as tuples
+        t_count = d_count = 0
+        rows = []
+        for p in parts_index:
+            c = p.get("category")
+            if c == "translate":
+                t_count += 1
+            else:
+                d_count += 1
+            rows.append((p.get("idx"), c, p.get("object_type"), p.get("reason"), p.get("name"), p.get("span_index")))
+        rows.sort(key=lambda r: r[0])
         st.caption(f"Translate: **{t_count}**  •  Dont-translate: **{d_count}**")
-        df = pd.DataFrame(parts_index)[
-            ["idx", "category", "object_type", "reason", "name", "span_index"]
-        ].sort_values("idx")
+        df = pd.DataFrame.from_records(
+            rows, columns=["idx", "category", "object_type", "reason", "name", "span_index"]
+        )
         st.dataframe(df, use_container_width=True, hide_index=True, height=350)
 
         st.divider()
         c1, c2 = st.columns(2)
         with c1:
             st.markdown("**Translate parts (raw)**")
-            tdir = STAGES["splitter"] / base / "translate"
-            for p in sorted(tdir.glob("part_*.sql")):
-                st.write(f"• {p.name}")
+            show_part_names(STAGES["splitter"] / base / "translate", key="page_translate")
         with c2:
             st.markdown("**Dont-translate parts (raw)**")
-            ddir = STAGES["splitter"] / base / "dont_translate"
-            for p in sorted(ddir.glob("part_*.sql")):
-                st.write(f"• {p.name}")
+            show_part_names(STAGES["splitter"] / base / "dont_translate", key="page_dont_translate")
 
 # --- Stages Browser ---
 with tab_stages:
@@ -348,7 +448,6 @@ with tab_diag:
     main_log = ROOT / "logs" / "main.log"
     if main_log.exists():
         st.caption(f"logs/main.log (last 2000 chars)")
-        tail = read_text(main_log)
-        st.code((tail[-2000:] if tail else ""), language="text")
+        st.code(_tail(main_log, 2000), language="text")
     else:
         st.caption("No main.log yet.")
@@ -3,15 +3,23 @@
 # Function-based, minimal, with logging to the exact path requested.
 
 from __future__ import annotations
+import os
 import json
 import re
 import hashlib
 import logging
 import traceback
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Iterator, List, Tuple, Dict, Any
 from datetime import datetime
 
+try:
+    import orjson  # optional: C-accelerated JSON encoding for chunk records
+except ImportError:
+    orjson = None
+
 # ---------- Constants & Config ----------
 
 CORPUS_DIR = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project\corpus"
@@ -21,14 +29,27 @@ LOG_FILE = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-transla
 
 # Front matter regex
 _FRONTMATTER_RE = re.compile(r"^---\s*\n(.*?)\n---\s*\n?", re.DOTALL)
+_FRONTMATTER_BYTES_RE = re.compile(rb"^---\s*\n(.*?)\n---\s*\n?", re.DOTALL)
+# Friendly cut points for oversized blocks
+_BOUNDARY_RE = re.compile(r"\n|\. ")
+# Markdown H2/H3 heading lines
+_HEADING_RE = re.compile(r"(?m)^(##|###) (.*)$")
+
+# Records buffered per write() call when emitting chunk JSONL
+_WRITE_BATCH = 256
 
 # ---------- Public entry point ----------
 
-def build_chunks(corpus_dir: str | Path, force: bool = False) -> Dict[str, Any]:
+def build_chunks(corpus_dir: str | Path, force: bool = False, paranoid: bool = False,
+                 workers: int | None = None) -> Dict[str, Any]:
     """
     Scans Markdown docs under {corpus}/commands, {corpus}/datatypes, {corpus}/scripting,
     and writes chunk files to {corpus}/chunks/<DocName>.jsonl following chunking_spec.json.
 
+    Unchanged docs are detected by mtime alone (one stat, no read). With paranoid=True
+    the body is also read and its sha1 compared against the manifest.
+    Changed docs are chunked in a process pool (workers=None → CPU count, 1 → inline).
+
     Returns a stats dict and logs progress to file + minimal console.
     """
     logger = _get_logger()
@@ -44,79 +65,65 @@ def build_chunks(corpus_dir: str | Path, force: bool = False) -> Dict[str, Any]:
         manifest_path = chunks_dir / "chunk_manifest.json"
         manifest = _load_manifest(manifest_path)
 
-        logger.info(f"Starting Phase 3 chunk build for corpus: {corpus.as_posix()}")
-        logger.debug(f"Spec loaded: {spec}")
+        logger.info("Starting Phase 3 chunk build for corpus: %s", corpus)
+        logger.debug("Spec loaded: %s", spec)
+
+        # Resolve spec knobs once (token ≈ char/4 heuristic) instead of per block/segment
+        params = (
+            spec.get("respect_code_blocks", True),
+            spec.get("respect_tables", True),
+            max(1, spec.get("target_tokens", 600)) * 4,
+            max(0, spec.get("overlap_tokens", 80)) * 4,
+        )
 
         processed = 0
         skipped = 0
         total_chunks = 0
+        dirty = False  # only rewrite the manifest when an entry actually changed
 
+        # Cheap mtime check here; only docs that may have changed go to the workers
+        jobs: List[Tuple[str, str, float, Dict[str, Any] | None]] = []
         for md_path in _iter_markdown_docs(corpus):
             rel = md_path.relative_to(corpus).as_posix()
-            try:
-                text = md_path.read_text(encoding="utf-8", errors="ignore")
-            except Exception as e:
-                logger.error(f"Failed to read {rel}: {e}")
-                logger.debug(traceback.format_exc())
-                continue
+            st = md_path.stat()  # one stat per doc; reused for the manifest entry
+            mtime = st.st_mtime
 
-            body_hash = _sha1(_extract_body(text))  # only the body
-
-            if not force and _is_unchanged(manifest, rel, md_path.stat().st_mtime, body_hash):
+            # Fast path: matching mtime means unchanged; skip read + hash entirely
+            rec = manifest.get("source_docs", {}).get(rel)
+            if not force and not paranoid and rec and abs(rec.get("mtime", 0) - mtime) < 1e-6:
                 skipped += 1
-                logger.debug(f"Skipping (unchanged): {rel}")
+                logger.debug("Skipping (unchanged mtime): %s", rel)
                 continue
+            jobs.append((md_path.as_posix(), rel, mtime, None if force else rec))
 
-            fm, body = _parse_front_matter(text)
-            page_title = fm.get("page_title", md_path.stem)
-
-            # Split by headings (##, ###), then chunk
-            blocks = _split_by_headings(body)
-            out_path = chunks_dir / f"{md_path.stem}.jsonl"
-            written_for_doc = 0
-
-            with out_path.open("w", encoding="utf-8") as f:
-                for block_text, heading_path in blocks:
-                    segments = _respect_code_and_tables(
-                        block_text,
-                        respect_code_blocks=spec.get("respect_code_blocks", True),
-                        respect_tables=spec.get("respect_tables", True),
-                    )
-                    for seg in segments:
-                        pieces = _chunk_text(
-                            seg,
-                            target_tokens=spec.get("target_tokens", 600),
-                            overlap_tokens=spec.get("overlap_tokens", 80),
-                        )
-                        for i, piece in enumerate(pieces):
-                            approx_tokens = max(1, len(piece) // 4)  # quick estimate
-                            base = f"{rel}::{heading_path}::{i}"
-                            chunk_id = _sha1(base)
-                            record = {
-                                "chunk_id": chunk_id,
-                                "doc_id": rel,
-                                "page_title": page_title,
-                                "heading_path": heading_path,
-                                "chunk_index": i,
-                                "text": piece,
-                                "approx_tokens": approx_tokens
-                            }
-                            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-                            written_for_doc += 1
+        for res in _run_jobs(jobs, chunks_dir.as_posix(), params, workers):
+            rel = res["rel"]
+            if res["status"] == "error":
+                logger.error("Failed to read %s: %s", rel, res["error"])
+                logger.debug(res["trace"])
+                continue
+            if res["status"] == "unchanged":
+                skipped += 1
+                logger.debug("Skipping (unchanged): %s", rel)
+                continue
 
             # Update manifest
             manifest.setdefault("source_docs", {})[rel] = {
-                "mtime": md_path.stat().st_mtime,
-                "total_chunks": written_for_doc,
-                "sha1_of_body": body_hash
+                "mtime": res["mtime"],
+                "total_chunks": res["written"],
+                "sha1_of_body": res["body_hash"]
             }
+            dirty = True
 
             processed += 1
-            total_chunks += written_for_doc
-            logger.info(f"Chunked {rel} → {written_for_doc} chunks")
+            total_chunks += res["written"]
+            logger.info("Chunked %s → %d chunks", rel, res["written"])
 
-        _save_manifest(manifest_path, manifest)
-        logger.info(f"Manifest updated at {manifest_path.as_posix()}")
+        if dirty:
+            _save_manifest(manifest_path, manifest)
+            logger.info("Manifest updated at %s", manifest_path)
+        else:
+            logger.debug("Manifest unchanged; skipping write")
 
         summary = {
             "processed_files": processed,
@@ -128,8 +135,9 @@ def build_chunks(corpus_dir: str | Path, force: bool = False) -> Dict[str, Any]:
         # Minimal console output
         print(f"[Phase 3] Chunks built. processed={processed} skipped={skipped} total_chunks={total_chunks}")
 
-        logger.info(f"Completed Phase 3 chunk build: processed={processed}, skipped={skipped}, total_chunks={total_chunks}")
-        logger.debug(f"Summary: {summary}")
+        logger.info("Completed Phase 3 chunk build: processed=%d, skipped=%d, total_chunks=%d",
+                    processed, skipped, total_chunks)
+        logger.debug("Summary: %s", summary)
         return summary
 
     except Exception as e:
@@ -139,16 +147,111 @@ def build_chunks(corpus_dir: str | Path, force: bool = False) -> Dict[str, Any]:
         raise
 
 
+# ---------- Per-document worker ----------
+
+def _run_jobs(jobs: List[Tuple[str, str, float, Dict[str, Any] | None]], chunks_dir: str,
+              params: Tuple[bool, bool, int, int], workers: int | None) -> Iterator[Dict[str, Any]]:
+    """Yield _process_one results in job order, inline or from a process pool."""
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _process_one(*job, chunks_dir, params)
+        return
+    paths, rels, mtimes, prevs = zip(*jobs)
+    n = len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        yield from ex.map(_process_one, paths, rels, mtimes, prevs,
+                          [chunks_dir] * n, [params] * n, chunksize=8)
+
+
+def _process_one(md_path_str: str, rel: str, mtime: float, prev_record: Dict[str, Any] | None,
+                 chunks_dir_str: str, params: Tuple[bool, bool, int, int]) -> Dict[str, Any]:
+    """
+    Chunk a single markdown doc into chunks/<stem>.jsonl. Runs in a worker process,
+    so it does not log; the parent logs from the returned status dict.
+    params = (respect_code_blocks, respect_tables, target_chars, overlap_chars).
+    """
+    respect_code, respect_tables, target_chars, overlap_chars = params
+    md_path = Path(md_path_str)
+    try:
+        raw = md_path.read_bytes()
+    except Exception as e:
+        return {"rel": rel, "status": "error", "error": str(e), "trace": traceback.format_exc()}
+
+    body_hash = _sha1_bytes(_body_bytes(raw))  # only the body, no decoded copy
+
+    if _is_unchanged(prev_record, mtime, body_hash):
+        return {"rel": rel, "status": "unchanged"}
+
+    # Decode only when we actually chunk (same newline handling as read_text)
+    text = raw.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    fm, body = _parse_front_matter(text)
+    page_title = fm.get("page_title", md_path.stem)
+
+    # Split by headings (##, ###), then chunk
+    blocks = _split_by_headings(body)
+    out_path = Path(chunks_dir_str) / f"{md_path.stem}.jsonl"
+    written_for_doc = 0
+
+    # chunk_id = sha1("{rel}::{heading_path}::{i}"); hash the shared prefixes once
+    # and copy the hasher state per block/piece instead of re-hashing the full key.
+    doc_prefix = hashlib.sha1(f"{rel}::".encode("utf-8", errors="ignore"))
+
+    buf = bytearray()
+    with out_path.open("wb") as f:
+        for block_text, heading_path in blocks:
+            block_prefix = doc_prefix.copy()
+            block_prefix.update(f"{heading_path}::".encode("utf-8", errors="ignore"))
+            segments = _respect_code_and_tables(
+                block_text,
+                respect_code_blocks=respect_code,
+                respect_tables=respect_tables,
+            )
+            for seg in segments:
+                pieces = _chunk_text(seg, target_chars=target_chars, overlap_chars=overlap_chars)
+                for i, piece in enumerate(pieces):
+                    approx_tokens = max(1, len(piece) // 4)  # quick estimate
+                    h = block_prefix.copy()
+                    h.update(str(i).encode())
+                    chunk_id = h.hexdigest()
+                    record = {
+                        "chunk_id": chunk_id,
+                        "doc_id": rel,
+                        "page_title": page_title,
+                        "heading_path": heading_path,
+                        "chunk_index": i,
+                        "text": piece,
+                        "approx_tokens": approx_tokens
+                    }
+                    buf += _dumps_bytes(record)
+                    buf += b"\n"
+                    written_for_doc += 1
+                    if written_for_doc % _WRITE_BATCH == 0:
+                        f.write(buf)
+                        buf.clear()
+        if buf:
+            f.write(buf)
+
+    return {"rel": rel, "status": "processed", "written": written_for_doc,
+            "mtime": mtime, "body_hash": body_hash}
+
+
 # ---------- Logging setup ----------
 
+_LOGGER: logging.Logger | None = None
+
 def _get_logger() -> logging.Logger:
     """
     Configure a singleton logger:
     - File handler: INFO/DEBUG/ERROR to fixed LOG_FILE (append).
     - Console handler: minimal INFO messages (generic progress).
+    Cached in _LOGGER after the first call so helpers skip the getLogger lookup.
     """
+    global _LOGGER
+    if _LOGGER is not None:
+        return _LOGGER
     logger = logging.getLogger("rag_phase3")
     if getattr(logger, "_configured", False):
+        _LOGGER = logger
         return logger
 
     logger.setLevel(logging.DEBUG)  # capture all; handlers will filter
@@ -170,7 +273,8 @@ def _get_logger() -> logging.Logger:
     logger.addHandler(ch)
 
     logger._configured = True  # type: ignore[attr-defined]
-    logger.debug(f"Logger initialized, writing to: {LOG_FILE}")
+    logger.debug("Logger initialized, writing to: %s", LOG_FILE)
+    _LOGGER = logger
     return logger
 
 
@@ -183,7 +287,7 @@ def _load_spec(spec_path: Path) -> Dict[str, Any]:
         logger.error(msg)
         raise FileNotFoundError(msg)
     spec = json.loads(spec_path.read_text(encoding="utf-8"))
-    logger.debug(f"Loaded spec from {spec_path.as_posix()}")
+    logger.debug("Loaded spec from %s", spec_path)
     return spec
 
 def _load_manifest(path: Path) -> Dict[str, Any]:
@@ -193,7 +297,7 @@ def _load_manifest(path: Path) -> Dict[str, Any]:
         return {"source_docs": {}}
     try:
         data = json.loads(path.read_text(encoding="utf-8"))
-        logger.debug(f"Loaded manifest from {path.as_posix()}")
+        logger.debug("Loaded manifest from %s", path)
         return data
     except Exception as e:
         logger.error(f"Failed to load manifest (will reset): {e}")
@@ -202,8 +306,12 @@ def _load_manifest(path: Path) -> Dict[str, Any]:
 
 def _save_manifest(path: Path, manifest: Dict[str, Any]) -> None:
     logger = _get_logger()
-    path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
-    logger.debug(f"Saved manifest to {path.as_posix()}")
+    # Compact encoding; write to a sibling temp file and swap it in so an
+    # interrupted run never leaves a truncated manifest behind.
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(_dumps_bytes(manifest))
+    os.replace(tmp, path)
+    logger.debug("Saved manifest to %s", path)
 
 
 def _iter_markdown_docs(corpus: Path) -> Iterator[Path]:
@@ -211,15 +319,35 @@ def _iter_markdown_docs(corpus: Path) -> Iterator[Path]:
     for topic in ("commands", "datatypes", "scripting"):
         base = corpus / topic
         if not base.exists():
-            logger.debug(f"Topic folder missing (skipped): {base.as_posix()}")
+            logger.debug("Topic folder missing (skipped): %s", base)
             continue
-        for p in base.rglob("*.md"):
-            logger.debug(f"Discovered markdown: {p.as_posix()}")
+        for p in _walk_markdown(base.as_posix()):
+            logger.debug("Discovered markdown: %s", p)
             yield p
 
 
-def _is_unchanged(manifest: Dict[str, Any], rel: str, mtime: float, body_hash: str) -> bool:
-    rec = manifest.get("source_docs", {}).get(rel)
+def _walk_markdown(root: str) -> Iterator[Path]:
+    """scandir walk: only .md files are turned into Path objects; hidden dirs are skipped."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif name.endswith(".md") and entry.is_file(follow_symlinks=False):
+                        yield Path(entry.path)
+        except OSError:
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def _is_unchanged(rec: Dict[str, Any] | None, mtime: float, body_hash: str) -> bool:
     if not rec:
         return False
     return abs(rec.get("mtime", 0) - mtime) < 1e-6 and rec.get("sha1_of_body") == body_hash
@@ -258,40 +386,30 @@ def _split_by_headings(text: str) -> List[Tuple[str, str]]:
     Split by ## (H2) and ### (H3).
     Returns list of (block_text, heading_path) where heading_path is "H2 > H3" or just "H2".
     If no headings, returns one block with empty path.
+    Blocks are sliced straight out of `text` between heading offsets (no per-line lists).
     """
-    lines = text.splitlines()
     blocks: List[Tuple[str, str]] = []
-    current: List[str] = []
     h2: str | None = None
     h3: str | None = None
-
-    def flush():
-        if current:
-            path = ""
-            if h2 and h3:
-                path = f"{h2} > {h3}"
-            elif h2:
-                path = h2
-            blocks.append(("\n".join(current).strip(), path))
-
-    for ln in lines:
-        if ln.startswith("## "):   # H2
-            flush()
-            current = [ln]
-            h2 = ln[3:].strip()
+    path = ""
+    block_start = 0
+
+    for m in _HEADING_RE.finditer(text):
+        if m.start() > block_start or blocks:
+            blocks.append((text[block_start:m.start()].strip(), path))
+        title = m.group(2).strip()
+        if m.group(1) == "##":   # H2
+            h2 = title
             h3 = None
-        elif ln.startswith("### "): # H3
-            flush()
-            current = [ln]
-            h3 = ln[4:].strip()
+        else:                    # H3
+            h3 = title
             if h2 is None:  # H3 without H2 → treat as H2
                 h2 = h3
                 h3 = None
-        else:
-            current.append(ln)
-    flush()
-    if not blocks:
-        blocks.append((text.strip(), ""))
+        path = f"{h2} > {h3}" if (h2 and h3) else (h2 or "")
+        block_start = m.start()
+
+    blocks.append((text[block_start:].strip(), path))
     return blocks
 
 
@@ -303,18 +421,15 @@ def _respect_code_and_tables(block: str, respect_code_blocks: bool, respect_tabl
     return [block]
 
 
-def _chunk_text(text: str, target_tokens: int, overlap_tokens: int) -> List[str]:
+def _chunk_text(text: str, target_chars: int, overlap_chars: int) -> List[str]:
     """
-    Paragraph-aware slicing with overlap. Token ≈ char/4 heuristic.
+    Paragraph-aware slicing with overlap. Sizes are in chars (token ≈ char/4, resolved by caller).
     """
     s = text.strip()
     if not s:
         return []
     paragraphs = s.split("\n\n")
 
-    target_chars = max(1, target_tokens) * 4
-    overlap_chars = max(0, overlap_tokens) * 4
-
     chunks: List[str] = []
     buf = ""
     for para in paragraphs:
@@ -340,40 +455,54 @@ def _chunk_text(text: str, target_tokens: int, overlap_tokens: int) -> List[str]
 def _slice_with_overlap(text: str, target_chars: int, overlap_chars: int) -> List[str]:
     """
     Slice a single block to ~target_chars with overlap, preferring friendly boundaries.
+    Boundary offsets are found in one regex scan and looked up per piece with bisect.
     """
     if len(text) <= target_chars:
         return [text]
 
+    # "\n" also covers the tail of every "\n\n"; ". " is the sentence boundary
+    bounds = [(m.start(), m.end()) for m in _BOUNDARY_RE.finditer(text)]
+    b_starts = [b[0] for b in bounds]
+    b_ends = [b[1] for b in bounds]
+
     pieces: List[str] = []
     start = 0
     n = len(text)
 
     while start < n:
         end = min(n, start + target_chars)
-        slice_text = text[start:end]
 
-        # Prefer boundaries: double newline, then single newline, then period+space.
-        cut = max(slice_text.rfind("\n\n"), slice_text.rfind("\n"), slice_text.rfind(". "))
-        if cut != -1 and end != n:
-            end = start + cut + 1  # keep boundary char
+        if end != n:
+            # Last boundary that fits entirely inside text[start:end]
+            k = bisect_right(b_ends, end) - 1
+            if k >= 0 and b_starts[k] >= start:
+                end = b_starts[k] + 1  # keep boundary char
 
         pieces.append(text[start:end].strip())
         if end == n:
             break
 
-        # Overlap
-        start = max(0, end - overlap_chars)
+        # Overlap (always move forward)
+        start = max(start + 1, end - overlap_chars)
 
     return pieces
 
 
-def _extract_body(text: str) -> str:
-    m = _FRONTMATTER_RE.match(text)
-    return text[m.end():] if m else text
+def _body_bytes(raw: bytes) -> memoryview:
+    m = _FRONTMATTER_BYTES_RE.match(raw)
+    view = memoryview(raw)
+    return view[m.end():] if m else view
+
+
+def _dumps_bytes(obj: Any) -> bytes:
+    """Compact UTF-8 JSON (orjson when available, stdlib otherwise)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
-def _sha1(s: str) -> str:
-    return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
+def _sha1_bytes(b: bytes | memoryview) -> str:
+    return hashlib.sha1(b).hexdigest()
 
 
 # ---------- CLI convenience ----------
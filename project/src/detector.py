@@ -11,6 +11,7 @@ import re
 import sys
 import json
 import logging
+import logging.handlers
 from pathlib import Path
 from typing import Dict, Any
 
@@ -26,34 +27,40 @@ def _get_logger() -> logging.Logger:
 
     log_path = Path(LOG_FILE)
     log_path.parent.mkdir(parents=True, exist_ok=True)  # ensure folder
-    fh = logging.FileHandler(log_path, mode="a", encoding="utf-8")
+    fh = logging.FileHandler(log_path, mode="a", encoding="utf-8", delay=True)
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+    # Buffer file writes (one INFO per detect_object call): flush every 64 records
+    # or at once on WARNING+; logging.shutdown() (atexit) flushes the rest.
+    mh = logging.handlers.MemoryHandler(64, flushLevel=logging.WARNING, target=fh)
+    mh.setLevel(logging.DEBUG)
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
     ch.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
-    logger.addHandler(fh)
+    logger.addHandler(mh)
     logger.addHandler(ch)
     logger._configured = True  # type: ignore[attr-defined]
     logger.debug("detector logger initialized")
     return logger
 
 # -------- Utilities --------
-# Remove /* */ and -- EOL comments, and single-quoted string literals.
-_COMMENT_BLOCK_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
-_COMMENT_LINE_RE  = re.compile(r"--[^\n]*")
-# Handles escaped single quotes '' inside strings.
-_STRING_RE        = re.compile(r"('(?:''|[^'])*')", re.DOTALL)
+# Remove /* */ and -- EOL comments, and single-quoted string literals, in one left-to-right
+# pass: whichever construct opens first wins (a '--' inside a string stays part of the string).
+# Strings handle escaped single quotes '' (unrolled loop: no per-character alternation).
+_STRIP_RE = re.compile(r"/\*.*?\*/|--[^\n]*|(?P<str>'[^']*(?:''[^']*)*')", re.DOTALL)
+
+def _strip_repl(m: re.Match) -> str:
+    # Strings become a placeholder to avoid false keyword hits; comments become a space
+    return " '' " if m.lastgroup == "str" else " "
 
 def _strip_comments_and_strings(sql: str) -> str:
-    s = _COMMENT_BLOCK_RE.sub(" ", sql)
-    s = _COMMENT_LINE_RE.sub(" ", s)
-    # Replace string literals with a placeholder to avoid false keyword hits
-    s = _STRING_RE.sub(" '' ", s)
-    return s
-
-# Identifier pieces: bare, [bracketed], or "quoted"
-_IDENT_PART = r'(?:\[.*?\]|".*?"|[A-Za-z_][A-Za-z0-9_\$]*)'
+    # Fast path: nothing to strip (no comment openers, no quotes) → reuse the input as-is
+    if "'" not in sql and "--" not in sql and "/*" not in sql:
+        return sql
+    return _STRIP_RE.sub(_strip_repl, sql)
+
+# Identifier pieces: bare, [bracketed], or "quoted" (bounded classes: closed by the first ]/" on the line)
+_IDENT_PART = r'(?:\[[^\]\n]*\]|"[^"\n]*"|[A-Za-z_][A-Za-z0-9_\$]*)'
 # Full (optionally schema-qualified) name: part(.part){0,2}
 _FULL_NAME = rf"{_IDENT_PART}(?:\s*\.\s*{_IDENT_PART}){{0,2}}"
 
@@ -67,11 +74,29 @@ _PROC_RE = re.compile(
     re.IGNORECASE | re.MULTILINE
 )
 
+_DOT_SPLIT_RE = re.compile(r"\s*\.\s*")
+
+# All hints in one alternation (run on cleaned text); BEGIN also counts as a proc token.
+# Same matches as \b(?:TOP\s+\d|BEGIN\b|...), but led by a class of the keywords' first
+# letters so the engine skips non-candidate characters in C; the word boundary and the
+# letter each branch expects are then checked behind that first character.
+_HINTS_RE = re.compile(
+    r"[BCDEGOQRT](?<=\b[BCDEGOQRT])(?:"
+    r"(?P<top>(?<=T)OP\s+\d)"
+    r"|(?P<begin>(?<=B)EGIN\b)"
+    r"|(?P<proc>(?:(?<=D)ECLARE|(?<=R)ETURN|(?<=E)ND|(?<=R)AISERROR|(?<=T)RY|(?<=C)ATCH)\b)"
+    r"|(?P<getdate>(?<=G)(?:ETDATE|ETUTCDATE)\s*\()"
+    r"|(?P<over>(?<=O)VER\s*\()"
+    r"|(?P<qualify>(?<=Q)UALIFY\b))",
+    re.IGNORECASE
+)
+_HINT_NAMES = frozenset(("top", "begin", "proc", "getdate", "over", "qualify"))
+
 def _normalize_name(raw: str | None) -> str | None:
     """Flatten whitespace around dots and strip outer quotes/brackets on each part."""
     if not raw:
         return None
-    parts = [p.strip() for p in re.split(r"\s*\.\s*", raw)]
+    parts = [p.strip() for p in _DOT_SPLIT_RE.split(raw)]
     norm_parts = []
     for p in parts:
         if p.startswith("[") and p.endswith("]"):
@@ -102,9 +127,13 @@ def detect_object(sql: str) -> Dict[str, Any]:
     try:
         cleaned = _strip_comments_and_strings(sql)
 
-        # Type + name
-        m_view = _VIEW_RE.search(cleaned)
-        m_proc = _PROC_RE.search(cleaned)
+        # Type + name. Usual case: the statement opens the text, so an anchored match
+        # (leading whitespace only) settles it; otherwise scan every line start.
+        m_view = _VIEW_RE.match(cleaned)
+        m_proc = None if m_view else _PROC_RE.match(cleaned)
+        if not m_view and not m_proc:
+            m_view = _VIEW_RE.search(cleaned)
+            m_proc = _PROC_RE.search(cleaned)
 
         if m_view and not m_proc:
             otype = "view"
@@ -119,23 +148,28 @@ def detect_object(sql: str) -> Dict[str, Any]:
         else:
             otype, name = None, None
 
-        # Hints (fast booleans, on cleaned text)
+        # Hints (fast booleans, one pass over cleaned text; stops once every hint is seen)
+        found = set()
+        for m in _HINTS_RE.finditer(cleaned):
+            found.add(m.lastgroup)
+            if len(found) == len(_HINT_NAMES):
+                break
         # TOP keyword (standalone)
-        has_top = bool(re.search(r"\bTOP\s+\d+", cleaned, re.IGNORECASE))
+        has_top = "top" in found
         # BEGIN token (likely T-SQL proc)
-        has_begin = bool(re.search(r"\bBEGIN\b", cleaned, re.IGNORECASE))
+        has_begin = "begin" in found
         # $$ dollar-quoted blocks (often pg-like scripting)
         has_dollar_quotes = "$$" in cleaned
         # proc-ish tokens in what appears to be a view (BEGIN, DECLARE, RETURN, etc.)
-        has_proc_tokens = bool(re.search(r"\b(DECLARE|RETURN|BEGIN|END|RAISERROR|TRY|CATCH)\b", cleaned, re.IGNORECASE))
+        has_proc_tokens = has_begin or "proc" in found
         has_proc_tokens_in_view = (otype == "view" and has_proc_tokens)
 
         # time functions common in T-SQL
-        has_getdate = bool(re.search(r"\b(GETDATE|GETUTCDATE)\s*\(", cleaned, re.IGNORECASE))
+        has_getdate = "getdate" in found
 
         # windowing / filtering cues
-        has_over_clause = bool(re.search(r"\bOVER\s*\(", cleaned, re.IGNORECASE))
-        has_qualify     = bool(re.search(r"\bQUALIFY\b", cleaned, re.IGNORECASE))
+        has_over_clause = "over" in found
+        has_qualify     = "qualify" in found
 
         res = {
             "object_type": otype,
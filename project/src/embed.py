@@ -5,11 +5,21 @@
 # - Provides build_embeddings(...) and retrieve(...)
 
 from __future__ import annotations
-import json, os, re, math, logging, traceback
+import json, os, re, sys, time, hashlib, logging, logging.handlers, traceback
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
+
+try:
+    import orjson  # optional: C-accelerated JSON parsing for embeds/meta/chunk files
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 # ======================
 # Fixed paths / settings
 # ======================
@@ -27,6 +37,8 @@ CHUNK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 EMBEDS_JSONL = CHUNK_CACHE_DIR / "embeds.jsonl"           # lines: {"chunk_id","vector":[...],"dim":...}
 META_JSONL   = CHUNK_CACHE_DIR / "meta.jsonl"             # lines: {"chunk_id","doc_id","page_title","heading_path","approx_tokens"}
 EMBEDS_MANIFEST = CHUNK_CACHE_DIR / "embeds_manifest.json"  # to skip unchanged chunks
+EMBEDS_NPY   = CHUNK_CACHE_DIR / "embeds.npy"             # float32 (N, D), latest vector per chunk_id
+EMBEDS_IDS   = CHUNK_CACHE_DIR / "embeds_ids.json"        # {"source": embeds.jsonl [mtime_ns, size], "ids": [...]} row order of embeds.npy
 
 # Retrieval constants
 WEIGHT_COSINE = 0.7
@@ -34,6 +46,10 @@ WEIGHT_KEYWORD = 0.3
 WEAK_SIMILARITY_THRESHOLD = 0.25
 HARD_CAP_DEFAULT = 8
 
+# Embedding calls (network-bound): concurrent batches + retry on HTTP 429
+EMBED_MAX_WORKERS = 8
+EMBED_RETRIES = 5
+
 # ======================
 # Logging
 # ======================
@@ -47,10 +63,14 @@ def _get_logger() -> logging.Logger:
     # Ensure log dir exists
     Path(EMBED_LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
 
-    fh = logging.FileHandler(EMBED_LOG_FILE, mode="a", encoding="utf-8")
+    fh = logging.FileHandler(EMBED_LOG_FILE, mode="a", encoding="utf-8", delay=True)
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
-    logger.addHandler(fh)
+    # Buffer file writes: flush every 64 records or at once on WARNING+;
+    # logging.shutdown() (atexit) flushes the rest.
+    mh = logging.handlers.MemoryHandler(64, flushLevel=logging.WARNING, target=fh)
+    mh.setLevel(logging.DEBUG)
+    logger.addHandler(mh)
 
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)  # minimal console
@@ -76,7 +96,7 @@ def load_settings(path: str | None = None) -> dict:
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"settings.json not found at {p}")
-    return json.loads(p.read_text(encoding="utf-8"))
+    return json.loads(p.read_bytes())  # bytes: json detects UTF-8/16 and tolerates a BOM
 
 def initialize_azure_openai_client(api_key=None, azure_endpoint=None):
     # Lazy import so file can be imported without this dependency until used
@@ -103,27 +123,27 @@ def _load_embeds_manifest() -> Dict[str, Any]:
 def _save_embeds_manifest(m: Dict[str, Any]) -> None:
     EMBEDS_MANIFEST.write_text(json.dumps(m, indent=2, ensure_ascii=False), encoding="utf-8")
 
-def _append_jsonl(path: Path, obj: Dict[str, Any]) -> None:
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+def _write_jsonl_lines(f, objs: List[Dict[str, Any]]) -> None:
+    """Write a batch of rows to an already-open JSONL handle in one call."""
+    if objs:
+        f.write("".join(json.dumps(o, ensure_ascii=False) + "\n" for o in objs))
 
-def _read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    if not path.exists():
-        return []
-    out: List[Dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as f:
+def _iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    """Stream rows from a JSONL file (bytes straight into the parser; missing file → nothing)."""
+    try:
+        f = path.open("rb")
+    except FileNotFoundError:
+        return
+    with f:
         for line in f:
-            line = line.strip()
-            if line:
-                out.append(json.loads(line))
-    return out
+            if line.strip():
+                yield _json_loads(line)
 
 def _iter_chunk_files() -> List[Path]:
     chunks_dir = CORPUS_DIR / "chunks"
     return sorted(chunks_dir.glob("*.jsonl"))
 
 def _sha1(s: str) -> str:
-    import hashlib
     return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
 
 # ======================
@@ -135,25 +155,6 @@ _WORD_RE = re.compile(r"[A-Za-z0-9_]+")
 def _tokenize(s: str) -> List[str]:
     return [w.lower() for w in _WORD_RE.findall(s)]
 
-def _keyword_overlap(query_tokens: List[str], text_tokens: List[str]) -> float:
-    if not query_tokens or not text_tokens:
-        return 0.0
-    qs = set(query_tokens)
-    ts = set(text_tokens)
-    inter = len(qs & ts)
-    denom = len(qs | ts)
-    return inter / denom if denom > 0 else 0.0
-
-def _cosine(a: List[float], b: List[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x*y for x, y in zip(a, b))
-    na = math.sqrt(sum(x*x for x in a))
-    nb = math.sqrt(sum(y*y for y in b))
-    if na == 0.0 or nb == 0.0:
-        return 0.0
-    return dot / (na * nb)
-
 # ======================
 # Embeddings (Azure OpenAI)
 # ======================
@@ -163,10 +164,21 @@ def _azure_embed_batch(client, deployment: str, texts: List[str]) -> List[List[f
     Call Azure OpenAI embeddings for a batch of texts.
     """
     # new OpenAI SDK returns .data with embeddings for each input in order
-    resp = client.embeddings.create(model=deployment, input=texts)
-    return [row.embedding for row in resp.data]
+    # Rate limits (openai.RateLimitError, status 429) are retried with exponential backoff.
+    delay = 1.0
+    for attempt in range(EMBED_RETRIES + 1):
+        try:
+            resp = client.embeddings.create(model=deployment, input=texts)
+            return [row.embedding for row in resp.data]
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429 or attempt == EMBED_RETRIES:
+                raise
+            _get_logger().warning(f"Embedding rate-limited; retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
 
-def build_embeddings(force: bool = False, batch_size: int = 64) -> Dict[str, Any]:
+def build_embeddings(force: bool = False, batch_size: int = 64,
+                     max_workers: int = EMBED_MAX_WORKERS) -> Dict[str, Any]:
     """
     Build embeddings for all chunks (incremental).
     - Reads corpus/chunks/*.jsonl
@@ -206,10 +218,11 @@ def build_embeddings(force: bool = False, batch_size: int = 64) -> Dict[str, Any
             logger.info("Force mode: cleared existing embeds/meta JSONL files.")
 
         # Pass 1: collect all chunks to embed
-        to_embed: List[Tuple[str, str, str, str, int]] = []  # (chunk_id, text, doc_id, page_title_heading, approx_tokens)
+        to_embed: List[Tuple[str, str, str, str, int, str]] = []  # (chunk_id, text, doc_id, page_title_heading, approx_tokens, sha1)
+        meta_lines: List[Dict[str, Any]] = []
 
         for file in _iter_chunk_files():
-            for rec in _read_jsonl(file):
+            for rec in _iter_jsonl(file):
                 chunk_id = rec["chunk_id"]
                 text = rec["text"]
                 doc_id = rec["doc_id"]
@@ -224,46 +237,60 @@ def build_embeddings(force: bool = False, batch_size: int = 64) -> Dict[str, Any
                     skipped += 1
                     continue
 
-                # Save meta line now (idempotent: appending duplicates is okay; we keep latest usage in manifest)
-                meta_line = {
+                # Meta line (idempotent: appending duplicates is okay; we keep latest usage in manifest)
+                meta_lines.append({
                     "chunk_id": chunk_id,
                     "doc_id": doc_id,
                     "page_title": page_title,
                     "heading_path": heading_path,
                     "approx_tokens": approx_tokens
-                }
-                _append_jsonl(META_JSONL, meta_line)
-                to_embed.append((chunk_id, text, doc_id, f"{page_title} > {heading_path}".strip(" >"), approx_tokens))
+                })
+                to_embed.append((chunk_id, text, doc_id, f"{page_title} > {heading_path}".strip(" >"), approx_tokens, content_hash))
 
-        logger.info(f"Collected {len(to_embed)} chunks to embed (skipped={skipped}).")
+        if meta_lines:
+            with META_JSONL.open("a", encoding="utf-8") as mf:
+                _write_jsonl_lines(mf, meta_lines)
 
-        # Pass 2: embed in batches
-        i = 0
-        while i < len(to_embed):
-            batch = to_embed[i:i+batch_size]
-            texts = [b[1] for b in batch]
-            try:
-                vecs = _azure_embed_batch(client, deployment, texts)
-            except Exception as e:
-                logger.error(f"Embedding batch failed at i={i}: {e}")
-                logger.debug(traceback.format_exc())
-                raise
-
-            for (chunk_id, text, doc_id, _title_heading, _tok), vec in zip(batch, vecs):
-                dim = len(vec)
-                _append_jsonl(EMBEDS_JSONL, {"chunk_id": chunk_id, "dim": dim, "vector": vec})
-                # Update manifest record
-                known[chunk_id] = {"doc_id": doc_id, "sha1": _sha1(text), "dim": dim}
-                new_vectors += 1
-
-            processed += len(batch)
-            logger.info(f"Embedded {processed}/{len(to_embed)}")
+        logger.info(f"Collected {len(to_embed)} chunks to embed (skipped={skipped}).")
 
-            i += batch_size
+        # Pass 2: embed batches concurrently (requests are I/O-bound); results are consumed
+        # in submission order so embeds.jsonl keeps the same line order. One handle, flushed per batch.
+        if to_embed:
+            with EMBEDS_JSONL.open("a", encoding="utf-8", buffering=1 << 20) as ef, \
+                    ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+                futures = [
+                    (i, ex.submit(_azure_embed_batch, client, deployment, [b[1] for b in to_embed[i:i+batch_size]]))
+                    for i in range(0, len(to_embed), batch_size)
+                ]
+                for i, fut in futures:
+                    batch = to_embed[i:i+batch_size]
+                    try:
+                        vecs = fut.result()
+                    except Exception as e:
+                        logger.error(f"Embedding batch failed at i={i}: {e}")
+                        logger.debug(traceback.format_exc())
+                        for _, pending in futures:
+                            pending.cancel()
+                        raise
+
+                    rows: List[Dict[str, Any]] = []
+                    for (chunk_id, _text, doc_id, _title_heading, _tok, content_hash), vec in zip(batch, vecs):
+                        dim = len(vec)
+                        rows.append({"chunk_id": chunk_id, "dim": dim, "vector": vec})
+                        # Update manifest record
+                        known[chunk_id] = {"doc_id": doc_id, "sha1": content_hash, "dim": dim}
+                        new_vectors += 1
+                    _write_jsonl_lines(ef, rows)
+                    ef.flush()
+
+                    processed += len(batch)
+                    logger.info(f"Embedded {processed}/{len(to_embed)}")
 
         # Save manifest
         manifest["chunks"] = known
         _save_embeds_manifest(manifest)
+        if new_vectors:
+            _load_vector_store()  # refresh the .npy sidecar so retrieve() starts from binary
 
         summary = {
             "embedded": new_vectors,
@@ -286,28 +313,157 @@ def build_embeddings(force: bool = False, batch_size: int = 64) -> Dict[str, Any
 # Retrieval
 # ======================
 
-def _load_vectors_and_meta() -> Tuple[Dict[str, List[float]], Dict[str, Dict[str, Any]]]:
+def _load_vector_store() -> Tuple[List[str], np.ndarray]:
     """
-    Returns:
-      vectors: chunk_id -> vector
-      meta:    chunk_id -> {doc_id,page_title,heading_path,approx_tokens}
+    Latest vector per chunk_id as (ids, float32 matrix).
+    embeds.jsonl stays the append log; embeds.npy + embeds_ids.json are a binary copy of it,
+    used when they were built from the current JSONL and rebuilt (then rewritten) otherwise.
     """
-    # Read vectors
+    sig = _file_sig(EMBEDS_JSONL)
+    if sig is None:
+        return [], np.empty((0, 0), dtype=np.float32)
+    try:
+        side = json.loads(EMBEDS_IDS.read_text(encoding="utf-8"))
+        if side.get("source") == list(sig):
+            mat = np.load(EMBEDS_NPY)
+            if mat.shape[0] == len(side["ids"]):
+                return side["ids"], mat
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Later lines win, same as the manifest
     vectors: Dict[str, List[float]] = {}
-    for row in _read_jsonl(EMBEDS_JSONL):
+    for row in _iter_jsonl(EMBEDS_JSONL):
         vectors[row["chunk_id"]] = row["vector"]
+    ids = list(vectors)
+    if not ids:
+        return [], np.empty((0, 0), dtype=np.float32)
+    mat = np.asarray(list(vectors.values()), dtype=np.float32)
+
+    try:
+        tmp = EMBEDS_NPY.with_suffix(".npy.tmp")
+        with tmp.open("wb") as f:
+            np.save(f, mat)
+        os.replace(tmp, EMBEDS_NPY)
+        # ids last: a stale/missing ids file just means the JSONL is parsed again
+        EMBEDS_IDS.write_text(json.dumps({"source": list(sig), "ids": ids}), encoding="utf-8")
+    except OSError as e:
+        _get_logger().warning(f"Could not write vector sidecar: {e}")
+    return ids, mat
+
+# Loaded store, reused across retrieve() calls until embeds/meta change on disk
+_CACHE: Dict[str, Any] = {"key": None, "store": None}
+
+def _file_sig(path: Path) -> Tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def store_signature() -> str:
+    """SHA-1 of the retrieval store's identity on disk: (mtime_ns, size) of embeds.jsonl and meta.jsonl."""
+    key = (_file_sig(EMBEDS_JSONL), _file_sig(META_JSONL))  # same key _load_vectors_and_meta caches on
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+def _load_vectors_and_meta() -> Dict[str, Any]:
+    """
+    Returns the retrieval store:
+      ids:        chunk_ids, one per matrix row (only chunks that also have meta)
+      mat:        float32 (N, D) matrix, rows L2-normalized so cosine is a plain dot product
+      meta:       chunk_id -> {doc_id,page_title,heading_path,approx_tokens}
+      meta_ids:   chunk_ids in meta order (M); keyword/bias vectors are indexed by this
+      postings:   token -> meta positions whose page_title + heading_path contain it
+      tok_counts: distinct proxy tokens per meta position (float64, M)
+      row_meta:   meta position of each matrix row (N)
+      meta_row:   matrix row of each meta position, -1 when it has no vector (M)
+      bias:       object_type -> bias vector (M), filled lazily
+    Cached in _CACHE keyed on (mtime_ns, size) of both JSONL files.
+    """
+    key = (_file_sig(EMBEDS_JSONL), _file_sig(META_JSONL))
+    if _CACHE["key"] == key:
+        return _CACHE["store"]
+
+    all_ids, raw = _load_vector_store()
 
-    # Read meta
+    # Read meta (doc_id/page_title/heading_path repeat across a doc's chunks: intern them
+    # so the cache holds one string object per distinct value)
+    intern = sys.intern
     meta: Dict[str, Dict[str, Any]] = {}
-    for row in _read_jsonl(META_JSONL):
+    for row in _iter_jsonl(META_JSONL):
         cid = row["chunk_id"]
         meta[cid] = {
-            "doc_id": row["doc_id"],
-            "page_title": row.get("page_title", ""),
-            "heading_path": row.get("heading_path", ""),
+            "doc_id": intern(row["doc_id"]),
+            "page_title": intern(row.get("page_title", "")),
+            "heading_path": intern(row.get("heading_path", "")),
             "approx_tokens": row.get("approx_tokens", 0)
         }
-    return vectors, meta
+
+    # Keyword proxy (page_title + heading_path) as an inverted index, built once here
+    meta_ids = list(meta)
+    pos_of = {cid: pos for pos, cid in enumerate(meta_ids)}
+    tok_counts = np.zeros(len(meta_ids), dtype=np.float64)
+    posting_lists: Dict[str, List[int]] = {}
+    for pos, cid in enumerate(meta_ids):
+        m = meta[cid]
+        toks = set(_tokenize(m["page_title"] + " " + m["heading_path"]))
+        tok_counts[pos] = len(toks)
+        for t in toks:
+            posting_lists.setdefault(t, []).append(pos)
+    postings = {t: np.asarray(p, dtype=np.intp) for t, p in posting_lists.items()}
+
+    rows = [j for j, cid in enumerate(all_ids) if cid in meta]
+    ids = [all_ids[j] for j in rows]
+    if ids:
+        mat = raw[rows]  # fancy indexing copies, so normalizing never touches the store
+        mat /= np.linalg.norm(mat, axis=1, keepdims=True).clip(min=1e-12)
+    else:
+        mat = np.empty((0, 0), dtype=np.float32)
+    row_meta = np.fromiter((pos_of[cid] for cid in ids), dtype=np.intp, count=len(ids))
+    meta_row = np.full(len(meta_ids), -1, dtype=np.intp)
+    meta_row[row_meta] = np.arange(len(ids), dtype=np.intp)
+
+    store = {
+        "ids": ids, "mat": mat, "meta": meta, "meta_ids": meta_ids,
+        "postings": postings, "tok_counts": tok_counts,
+        "row_meta": row_meta, "meta_row": meta_row, "bias": {},
+    }
+    _CACHE.update(key=key, store=store)
+    return store
+
+def _keyword_scores(store: Dict[str, Any], q_set: frozenset) -> np.ndarray:
+    """Jaccard(query tokens, proxy tokens) for every meta position, via the postings."""
+    counts = store["tok_counts"]
+    inter = np.zeros(counts.shape[0], dtype=np.float64)
+    postings = store["postings"]
+    for t in q_set:
+        p = postings.get(t)
+        if p is not None:
+            inter[p] += 1.0
+    union = counts + len(q_set) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=counts > 0)
+
+def _bias_vector(store: Dict[str, Any], object_type: str | None) -> np.ndarray:
+    b = store["bias"].get(object_type)
+    if b is None:
+        meta = store["meta"]
+        b = np.fromiter((_object_type_bias(meta[cid].get("doc_id", ""), object_type) for cid in store["meta_ids"]),
+                        dtype=np.float64, count=len(store["meta_ids"]))
+        store["bias"][object_type] = b
+    return b
+
+def _ranked(score: np.ndarray, k: int) -> Iterator[np.ndarray]:
+    """
+    Row indices by descending score (ties keep row order, like a stable full sort).
+    First yields only the top-k (O(N) partition, ties at the cut included); then, if the
+    caller is still iterating (dedupe left too few), the full ordering.
+    """
+    n = score.shape[0]
+    if k < n:
+        kth = np.partition(-score, k - 1)[k - 1]
+        cand = np.flatnonzero(-score <= kth)
+        yield cand[np.argsort(-score[cand], kind="stable")]
+    yield np.argsort(-score, kind="stable")
 
 def _object_type_bias(doc_id: str, object_type: str | None) -> float:
     """
@@ -330,131 +486,130 @@ def _object_type_bias(doc_id: str, object_type: str | None) -> float:
         return 0.0
     return 0.0
 
-def retrieve(query: str, object_type: str | None = None,
-             k_per_folder: int = 6, hard_cap: int = HARD_CAP_DEFAULT) -> Dict[str, Any]:
+def _query_plan(store: Dict[str, Any], query: str, object_type: str | None):
     """
-    Retrieve top chunks by cosine + keyword_overlap (0.7/0.3), dedupe by page_title+heading_path, cap to hard_cap.
-    Requires built embeddings (run build_embeddings first).
+    (query vector, keyword scores, bias scores) for one query, or an early result
+    dict when the query has no usable tokens / seed vectors.
     """
+    mat = store["mat"]
+    # Build a simple "query vector" by embedding the query text again?
+    # We don't have the model here; instead we synthesize a pseudo-vector
+    # by averaging top-N chunk vectors that match keywords. To keep it minimal
+    # AND deterministic without another API call, we do:
+    # 1) Tokenize query
+    # 2) Score keyword overlap against each meta text proxy (page_title + heading_path)
+    # 3) Take top 50 by keyword score, average their vectors as query vector.
+    q_set = frozenset(_tokenize(query))
+    if not q_set:
+        return {"chunks": [], "retrieval_weak": True, "stats": {"reason": "empty_query"}}
+
+    # Keyword overlap + type bias for every meta entry at once (no raw text stored here)
+    kw_all = _keyword_scores(store, q_set)
+    bias_all = _bias_vector(store, object_type)
+    proxy = kw_all + bias_all
+    hits = np.flatnonzero(proxy > 0)
+    if hits.size:
+        # stable sort keeps meta order among ties
+        seed_pos = hits[np.argsort(-proxy[hits], kind="stable")[:50]]  # top 50 proxies to form a query vector
+    else:
+        # If no keyword hits via proxies, fallback to all chunks with zero keyword score
+        seed_pos = np.arange(min(50, len(store["meta_ids"])), dtype=np.intp)
+
+    # Average seed vectors into a query vector
+    seed_idx = store["meta_row"][seed_pos]
+    seed_idx = seed_idx[seed_idx >= 0]
+    if not seed_idx.size:
+        return {"chunks": [], "retrieval_weak": True, "stats": {"reason": "no_seed_vectors"}}
+    qvec = mat[seed_idx].sum(axis=0)  # direction is all that matters; normalized below
+    qnorm = np.linalg.norm(qvec)
+    if qnorm > 0:
+        qvec /= qnorm
+    return qvec, kw_all, bias_all
+
+def _rank_results(store: Dict[str, Any], query: str, cos_raw: np.ndarray,
+                  kw_all: np.ndarray, bias_all: np.ndarray, hard_cap: int) -> Dict[str, Any]:
+    """Blend cosine (cos_raw = mat @ qvec) with keyword scores, dedupe, cap and build the payload."""
     logger = _get_logger()
-    try:
-        vectors, meta = _load_vectors_and_meta()
-        if not vectors:
-            raise RuntimeError("No vectors loaded. Run build_embeddings() first.")
-
-        # Build a simple "query vector" by embedding the query text again?
-        # We don't have the model here; instead we synthesize a pseudo-vector
-        # by averaging top-N chunk vectors that match keywords. To keep it minimal
-        # AND deterministic without another API call, we do:
-        # 1) Tokenize query
-        # 2) Score keyword overlap against each meta text proxy (page_title + heading_path)
-        # 3) Take top 50 by keyword score, average their vectors as query vector.
-        q_tokens = _tokenize(query)
-        if not q_tokens:
-            return {"chunks": [], "retrieval_weak": True, "stats": {"reason": "empty_query"}}
-
-        # Build a tiny text proxy for each chunk from meta only (no raw text stored here)
-        proxies: List[Tuple[str, float]] = []  # (chunk_id, kw_overlap)
-        for cid, m in meta.items():
-            proxy_text = (m.get("page_title","") + " " + m.get("heading_path","")).strip()
-            kw = _keyword_overlap(q_tokens, _tokenize(proxy_text))
-            # Small boost if object_type bias applies
-            kw += _object_type_bias(m.get("doc_id",""), object_type)
-            if kw > 0:
-                proxies.append((cid, kw))
+    ids, meta = store["ids"], store["meta"]
 
-        # If no keyword hits via proxies, fallback to all chunks with zero keyword score
-        if not proxies:
-            proxies = [(cid, 0.0) for cid in meta.keys()]
-
-        proxies.sort(key=lambda x: x[1], reverse=True)
-        seed_ids = [cid for cid, _ in proxies[:50]]  # top 50 proxies to form a query vector
-
-        # Average vectors for a seed query vector
-        dim = None
-        qvec = None
-        count = 0
-        for cid in seed_ids:
-            vec = vectors.get(cid)
-            if vec is None:
-                continue
-            if dim is None:
-                dim = len(vec)
-                qvec = [0.0]*dim
-            # accumulate
-            for i, v in enumerate(vec):
-                qvec[i] += v
-            count += 1
-        if not qvec or count == 0:
-            return {"chunks": [], "retrieval_weak": True, "stats": {"reason": "no_seed_vectors"}}
-        qvec = [x / max(1, count) for x in qvec]
-
-        # Score all candidates
-        scored: List[Tuple[str, float, float]] = []  # (cid, cosine, kw)
-        for cid, m in meta.items():
-            vec = vectors.get(cid)
-            if not vec:
-                continue
-            cos = _cosine(qvec, vec)
-            # keyword overlap against fuller proxy: page_title + heading_path (kept minimal on purpose)
-            kw = _keyword_overlap(q_tokens, _tokenize(m.get("page_title","") + " " + m.get("heading_path","")))
-            cos += _object_type_bias(m.get("doc_id",""), object_type)  # tiny cosine bump for bias
-            scored.append((cid, cos, kw))
-
-        # Re-rank
-        reranked: List[Tuple[str, float, float, float]] = []  # (cid, score, cos, kw)
-        for cid, cos, kw in scored:
-            score = WEIGHT_COSINE * cos + WEIGHT_KEYWORD * kw
-            reranked.append((cid, score, cos, kw))
-        reranked.sort(key=lambda x: x[1], reverse=True)
-
-        # Dedupe by (page_title + heading_path)
+    # Score all candidates: rows are normalized, so one matmul gives every cosine
+    row_meta = store["row_meta"]
+    cos_all = cos_raw + bias_all[row_meta]  # tiny cosine bump for bias
+    kw_rows = kw_all[row_meta]
+    score_all = WEIGHT_COSINE * cos_all + WEIGHT_KEYWORD * kw_rows
+
+    # Re-rank + dedupe by (page_title + heading_path)
+    for order in _ranked(score_all, max(1, hard_cap) * 4):
         seen_keys = set()
         final_items = []
-        for cid, score, cos, kw in reranked:
+        for j in order.tolist():
+            cid = ids[j]
             m = meta[cid]
             dedupe_key = (m.get("page_title","") + " | " + m.get("heading_path","")).strip()
             if dedupe_key in seen_keys:
                 continue
             seen_keys.add(dedupe_key)
-            final_items.append((cid, score, cos, kw))
+            final_items.append((cid, float(score_all[j]), float(cos_all[j]), float(kw_rows[j])))
             if len(final_items) >= hard_cap:
                 break
-
-        retrieval_weak = False
-        if final_items:
-            # Look at top item's cosine component as signal
-            top_cos = final_items[0][2]
-            retrieval_weak = (top_cos < WEAK_SIMILARITY_THRESHOLD)
-
-        # Build response payload
-        chunks = []
-        for cid, score, cos, kw in final_items:
-            m = meta[cid]
-            chunks.append({
-                "doc_id": m["doc_id"],
-                "page_title": m["page_title"],
-                "heading_path": m["heading_path"],
-                "chunk_id": cid,
-                "score": round(score, 4),
-                "cosine": round(cos, 4),
-                "keyword_overlap": round(kw, 4),
-                "citation": f"{m['page_title']} > {m['heading_path']}".strip(" >")
-            })
-
-        res = {
-            "chunks": chunks,
-            "retrieval_weak": retrieval_weak,
-            "stats": {
-                "candidates": len(scored),
-                "after_dedupe": len(chunks),
-                "threshold": WEAK_SIMILARITY_THRESHOLD
-            }
+        if len(final_items) >= hard_cap:
+            break
+
+    retrieval_weak = False
+    if final_items:
+        # Look at top item's cosine component as signal
+        top_cos = final_items[0][2]
+        retrieval_weak = (top_cos < WEAK_SIMILARITY_THRESHOLD)
+
+    # Build response payload
+    chunks = []
+    for cid, score, cos, kw in final_items:
+        m = meta[cid]
+        chunks.append({
+            "doc_id": m["doc_id"],
+            "page_title": m["page_title"],
+            "heading_path": m["heading_path"],
+            "chunk_id": cid,
+            "score": round(score, 4),
+            "cosine": round(cos, 4),
+            "keyword_overlap": round(kw, 4),
+            "citation": f"{m['page_title']} > {m['heading_path']}".strip(" >")
+        })
+
+    res = {
+        "chunks": chunks,
+        "retrieval_weak": retrieval_weak,
+        "stats": {
+            "candidates": len(ids),
+            "after_dedupe": len(chunks),
+            "threshold": WEAK_SIMILARITY_THRESHOLD
         }
-        print(f"[Phase 4] Retrieved {len(chunks)} chunks (weak={retrieval_weak})")
-        logger.info(f"retrieve: query='{query[:100]}...' -> {len(chunks)} chunks; weak={retrieval_weak}")
-        logger.debug(f"retrieve stats: {res['stats']}")
-        return res
+    }
+    print(f"[Phase 4] Retrieved {len(chunks)} chunks (weak={retrieval_weak})")
+    logger.info(f"retrieve: query='{query[:100]}...' -> {len(chunks)} chunks; weak={retrieval_weak}")
+    logger.debug(f"retrieve stats: {res['stats']}")
+    return res
+
+def _require_store() -> Dict[str, Any]:
+    store = _load_vectors_and_meta()
+    if not store["ids"]:
+        raise RuntimeError("No vectors loaded. Run build_embeddings() first.")
+    return store
+
+def retrieve(query: str, object_type: str | None = None,
+             k_per_folder: int = 6, hard_cap: int = HARD_CAP_DEFAULT) -> Dict[str, Any]:
+    """
+    Retrieve top chunks by cosine + keyword_overlap (0.7/0.3), dedupe by page_title+heading_path, cap to hard_cap.
+    Requires built embeddings (run build_embeddings first).
+    """
+    logger = _get_logger()
+    try:
+        store = _require_store()
+        plan = _query_plan(store, query, object_type)
+        if isinstance(plan, dict):
+            return plan
+        qvec, kw_all, bias_all = plan
+        return _rank_results(store, query, store["mat"] @ qvec, kw_all, bias_all, hard_cap)
 
     except Exception as e:
         logger = _get_logger()
@@ -462,6 +617,32 @@ def retrieve(query: str, object_type: str | None = None,
         logger.debug(traceback.format_exc())
         raise
 
+def retrieve_batch(items: List[Tuple[str, str | None]],
+                   k_per_folder: int = 6, hard_cap: int = HARD_CAP_DEFAULT) -> List[Dict[str, Any]]:
+    """
+    retrieve() for many (query, object_type) pairs at once: the store is loaded once
+    and every query's cosines come from a single matrix product (n x d @ d x b).
+    Results are in input order.
+    """
+    logger = _get_logger()
+    try:
+        store = _require_store()
+        plans = [_query_plan(store, q, ot) for q, ot in items]
+        out: List[Dict[str, Any] | None] = [p if isinstance(p, dict) else None for p in plans]
+        live = [i for i, p in enumerate(plans) if not isinstance(p, dict)]
+        if live:
+            cos = store["mat"] @ np.stack([plans[i][0] for i in live], axis=1)
+            for j, i in enumerate(live):
+                _, kw_all, bias_all = plans[i]
+                out[i] = _rank_results(store, items[i][0], cos[:, j], kw_all, bias_all, hard_cap)
+        logger.debug(f"retrieve_batch: {len(items)} queries, {len(live)} scored")
+        return out  # type: ignore[return-value]
+
+    except Exception as e:
+        logger.error(f"Unhandled error in retrieve_batch: {e}")
+        logger.debug(traceback.format_exc())
+        raise
+
 # ======================
 # CLI convenience
 # ======================
@@ -470,7 +651,6 @@ if __name__ == "__main__":
     # Minimal CLI:
     #   python embed.py build
     #   python embed.py retrieve "TOP 10 with GETDATE in a VIEW"
-    import sys
     logger = _get_logger()
     try:
         if len(sys.argv) < 2:
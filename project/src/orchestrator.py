@@ -13,10 +13,22 @@
 from __future__ import annotations
 import re
 import json
+import os
+import bisect
+import functools
+import hashlib
 import logging
 import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Iterable
+
+try:
+    import orjson  # optional: C-accelerated JSON for stage artifacts/manifests
+except ImportError:
+    orjson = None
 
 # ---- Fixed paths ----
 ROOT = Path(r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project")
@@ -26,6 +38,17 @@ MANIFESTS  = ROOT / "output" / "manifests"
 LOG_FILE   = ROOT / "logs" / "main.log"
 SETTINGS   = ROOT / "settings.json"
 
+# Parts translated concurrently (LLM/embedding calls are network-bound)
+MAX_PARALLEL_PARTS = 8
+# Per-stage concurrency caps; parts flow through the stages as a pipeline
+# (part K in pass2 while K+1 is in pass1...), each stage bounded on its own.
+# Override with settings["stage_workers"] = {"retrieve": 1, ...}
+STAGE_WORKERS = {"retrieve": 4, "translator_pass1": 8, "translator_pass2": 8}
+# Retrieval results memoized per (object_type, normalized query)
+RETRIEVE_CACHE_MAX = 512
+# settings.json keys that change what a run writes; part of the manifest's run_sig
+OUTPUT_SETTINGS_KEYS = ("chat_deployment", "embedding_deployment", "single_pass")
+
 # Stage roots
 STAGES = {
     "splitter": ROOT / "output" / "splitter",
@@ -38,14 +61,15 @@ STAGES = {
 
 # ---- Imports from other modules ----
 from detector import detect_object
-from embed import retrieve
+from embed import retrieve, retrieve_batch, store_signature
 from validator import make_signals
-from translator import pass1_translate, pass2_repair, prepend_summary
+from translator import pass1_translate, pass2_repair, pass_combined, prepend_summary, prompt_signature
 
 # ---- Logger ----
+@functools.lru_cache(maxsize=1)
 def _get_logger() -> logging.Logger:
     logger = logging.getLogger("main_orchestrator")
-    if getattr(logger, "_configured", False):
+    if getattr(logger, "_configured", False):  # handlers survive a module reload
         return logger
     logger.setLevel(logging.DEBUG)
     LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
@@ -63,46 +87,107 @@ def _get_logger() -> logging.Logger:
 
 # ---- Settings ----
 def _load_settings() -> Dict[str, Any]:
-    if not SETTINGS.exists():
+    try:
+        mtime_ns = SETTINGS.stat().st_mtime_ns
+    except OSError:
         return {}
+    return _read_settings(str(SETTINGS), mtime_ns)
+
+@functools.lru_cache(maxsize=1)
+def _read_settings(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parsed settings.json, re-read only when the file changes."""
     try:
-        return json.loads(SETTINGS.read_text(encoding="utf-8"))
+        return json.loads(Path(path).read_bytes())  # bytes: json detects UTF-8/16 and tolerates a BOM
     except Exception:
         return {}
 
 # ---- File IO helpers ----
+# Directories already created by this process (cleared per run and on rmtree)
+_MKDIR_CACHE: set[Path] = set()
+
+def _ensure_dir(d: Path) -> None:
+    if d not in _MKDIR_CACHE:
+        d.mkdir(parents=True, exist_ok=True)
+        _MKDIR_CACHE.add(d)
+
 def _stage_dir(stage: str, base: str, clean: bool = False) -> Path:
     """Return stage/<base> dir; if clean, delete and recreate."""
     root = STAGES[stage]
     d = root / base
-    if clean and d.exists():
-        shutil.rmtree(d, ignore_errors=True)
-    d.mkdir(parents=True, exist_ok=True)
+    if clean:
+        if d.exists():
+            shutil.rmtree(d, ignore_errors=True)
+        _MKDIR_CACHE.difference_update([x for x in _MKDIR_CACHE if x == d or d in x.parents])
+    _ensure_dir(d)
     return d
 
-def _write_text(stage: str, base: str, rel_name: str, content: str) -> Path:
-    d = _stage_dir(stage, base)  # ensure exists
-    p = d / rel_name
-    p.parent.mkdir(parents=True, exist_ok=True)
+def _write_text(stage: str, base: str, rel_name: str, content: str,
+                pending: List[Tuple[Path, str]] | None = None) -> Path:
+    """Write stage/<base>/<rel_name>; with `pending`, only queue it for _flush_writes."""
+    p = STAGES[stage] / base / rel_name
+    if pending is not None:
+        pending.append((p, content))
+        return p
+    _ensure_dir(p.parent)
     p.write_text(content, encoding="utf-8")
     return p
 
-def _write_json(stage: str, base: str, rel_name: str, obj: Any) -> Path:
-    d = _stage_dir(stage, base)  # ensure exists
-    p = d / rel_name
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
-    return p
+def _json_dumps(obj: Any) -> str:
+    """Indented JSON (orjson when available, stdlib otherwise)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. ints beyond 64 bits; let stdlib handle it
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+def _write_json(stage: str, base: str, rel_name: str, obj: Any,
+                pending: List[Tuple[Path, str]] | None = None) -> Path:
+    return _write_text(stage, base, rel_name, _json_dumps(obj), pending)
+
+def _flush_writes(pending: List[Tuple[Path, str]]) -> None:
+    """Write queued artifacts in one pass (one mkdir per directory)."""
+    for p, content in pending:
+        _ensure_dir(p.parent)
+        with open(p, "w", encoding="utf-8") as fh:
+            fh.write(content)
+    pending.clear()
 
 def list_input_files() -> List[Path]:
-    INPUT_DIR.mkdir(parents=True, exist_ok=True)
-    return sorted(INPUT_DIR.glob("*.sql"))
+    _ensure_dir(INPUT_DIR)
+    # one directory read; DirEntry type info avoids a stat per file.
+    # normcase keeps glob's case-insensitive match on Windows (*.SQL)
+    with os.scandir(INPUT_DIR) as it:
+        files = [Path(e.path) for e in it
+                 if os.path.normcase(e.name).endswith(".sql") and e.is_file()]
+    files.sort()
+    return files
 
 def read_sql_file(path: Path) -> str:
-    return path.read_text(encoding="utf-8", errors="ignore")
+    return _decode_sql(path.read_bytes())
+
+def _decode_sql(data: bytes) -> str:
+    # pure-ASCII dumps (the common case) skip the UTF-8 error-handling path
+    text = data.decode("ascii") if data.isascii() else data.decode("utf-8", errors="ignore")
+    if "\r" in text:  # same universal-newline result read_text() gave
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+def _write_sql_blocks(path: Path, blocks: Iterable[Tuple[str, str]]) -> None:
+    """
+    Stream "<header>\n<body>\n\n" blocks to path without building the whole file
+    in memory; output equals "\n".join(lines).rstrip() + "\n" over the same lines.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        prev = None
+        for header, body in blocks:
+            if prev is not None:
+                f.write(prev + "\n\n")
+            prev = f"{header}\n{body.rstrip()}"
+        f.write((prev or "").rstrip() + "\n")
 
 def write_final_output(base_name: str, content: str) -> Path:
-    FINAL_DIR.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(FINAL_DIR)
     out_path = FINAL_DIR / f"{base_name}_snowflake.sql"
     out_path.write_text(content, encoding="utf-8")
     return out_path
@@ -112,14 +197,32 @@ def write_final_output(base_name: str, content: str) -> Path:
 _OBJ_START_RE = re.compile(r"(?im)^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(VIEW|PROCEDURE|PROC)\s+[^\n]+")
 # Dollar-quoted blocks
 _DOLLAR_BLOCK_RE = re.compile(r"(?is)\$\$.*?\$\$")
-# Exec extended property
-_EXTPROP_RE = re.compile(r"(?im)^\s*EXEC\s+sys\.sp_addextendedproperty\b")
-# Top-level admin tokens
-_ADMIN_RE = re.compile(r"(?im)^\s*(USE|SET|GO|ALTER\s+SESSION)\b")
+# First-line classifier: CREATE object | extended property | admin token | comment,
+# tried in that order; the matching branch is read from m.lastgroup
+_CLASSIFY_RE = re.compile(
+    r"(?i)\s*(?:"
+    r"(?P<create>CREATE\s+(?:OR\s+REPLACE\s+)?(?P<kind>VIEW|PROCEDURE|PROC)\s+[^\n]+)"
+    r"|(?P<extprop>EXEC\s+sys\.sp_addextendedproperty\b)"
+    r"|(?P<admin>(?:USE|SET|GO|ALTER\s+SESSION)\b)"
+    r"|(?P<comment>--))"
+)
+# Head of a CREATE block (kind + object name)
+_CREATE_HEAD_RE = re.compile(r"(?is)^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(VIEW|PROCEDURE|PROC)\s+([^\s\(;]+)")
+# Batch separator line
+_GO_LINE_RE = re.compile(r"(?im)^\s*GO\s*$")
+_NEWLINE_RE = re.compile(r"\n")
+# First non-whitespace char / max chars of a first line the classifier inspects
+_NON_WS_RE = re.compile(r"\S")
+_FIRST_LINE_CAP = 512
 
 def _mask_dollar_blocks(s: str) -> str:
     return _DOLLAR_BLOCK_RE.sub(lambda m: " " * (m.end() - m.start()), s)
 
+def _in_spans(pos: int, starts: List[int], spans: List[Tuple[int, int]]) -> bool:
+    """True if pos falls inside one of the sorted, non-overlapping spans."""
+    k = bisect.bisect_right(starts, pos) - 1
+    return k >= 0 and pos < spans[k][1]
+
 def _zero(n: int) -> str:
     return f"{n:04d}"
 
@@ -129,6 +232,13 @@ def split_into_objects(tsql: str) -> List[Dict[str, Any]]:
     """
     text = tsql
     masked = _mask_dollar_blocks(text)
+    # $$...$$ intervals + GO lines, computed once for the whole text
+    dollar_spans = [(m.start(), m.end()) for m in _DOLLAR_BLOCK_RE.finditer(text)]
+    dollar_starts = [a for a, _ in dollar_spans]
+    go_abs = [m.start() for m in _GO_LINE_RE.finditer(text)
+              if not _in_spans(m.start(), dollar_starts, dollar_spans)]
+    # newline offsets, only needed to skip past GO lines
+    newlines = [m.start() for m in _NEWLINE_RE.finditer(text)] if go_abs else []
 
     parts: List[Dict[str, Any]] = []
     starts = [m.start() for m in _OBJ_START_RE.finditer(masked)]
@@ -136,7 +246,7 @@ def split_into_objects(tsql: str) -> List[Dict[str, Any]]:
 
     def add_part(idx: int, span_text: str, is_preamble: bool = False):
         head = span_text[:400]
-        m = re.search(r"(?is)^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(VIEW|PROCEDURE|PROC)\s+([^\s\(;]+)", head)
+        m = _CREATE_HEAD_RE.search(head)
         obj_type = None
         name = None
         if m:
@@ -166,8 +276,9 @@ def split_into_objects(tsql: str) -> List[Dict[str, Any]]:
         block = text[start:end]
 
         # split on GO only if not inside $$...$$
-        block_masked = _mask_dollar_blocks(block)
-        go_positions = [m.start() for m in re.finditer(r"(?im)^\s*GO\s*$", block_masked)]
+        lo = bisect.bisect_left(go_abs, start)
+        hi = bisect.bisect_left(go_abs, end)
+        go_positions = [g - start for g in go_abs[lo:hi]]
 
         if not go_positions:
             add_part(start, block, is_preamble=False)
@@ -179,7 +290,8 @@ def split_into_objects(tsql: str) -> List[Dict[str, Any]]:
                     add_part(start + last, segment, is_preamble=False)
                 # skip the GO line itself
                 # advance to just after the GO line end
-                nl_pos = block.find("\n", gpos)
+                k = bisect.bisect_left(newlines, start + gpos)
+                nl_pos = newlines[k] - start if k < len(newlines) and newlines[k] < end else -1
                 last = (nl_pos + 1) if nl_pos != -1 else len(block)
             tail = block[last:]
             if tail.strip():
@@ -192,7 +304,15 @@ def _classify_part(part: Dict[str, Any]) -> Dict[str, Any]:
     Determine translate vs dont_translate, object_type/admin/metadata/unknown, and reason.
     """
     txt = part.get("text", "")
-    first_line = txt.lstrip().splitlines()[0] if txt.strip() else ""
+    # First non-blank line, without copying/splitting the whole part; the
+    # classifier regexes only look at its leading tokens, so cap it too.
+    first_line = ""
+    m0 = _NON_WS_RE.search(txt)
+    if m0:
+        i = m0.start()
+        nl = txt.find("\n", i, i + _FIRST_LINE_CAP)
+        head = txt[i:nl] if nl != -1 else txt[i:i + _FIRST_LINE_CAP]
+        first_line = head.splitlines()[0]
     reason = ""
     category = "dont_translate"
     otype = part.get("object_type") or None
@@ -201,17 +321,20 @@ def _classify_part(part: Dict[str, Any]) -> Dict[str, Any]:
         reason = "preamble/top-level"
         return {**part, "object_type": "admin", "category": "dont_translate", "reason": reason}
 
-    if _OBJ_START_RE.match(first_line):
+    m = _CLASSIFY_RE.match(first_line)
+    kind_of_line = m.lastgroup if m else None
+
+    if kind_of_line == "create":
         # CREATE VIEW/PROCEDURE => translate
-        kind = re.match(r"(?im)^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(VIEW|PROCEDURE|PROC)\b", first_line).group(1).lower()
+        kind = m.group("kind").lower()  # already captured by the classifier match
         otype = "view" if kind == "view" else "procedure"
         reason = f"CREATE {kind.upper()}"
         category = "translate"
-    elif _EXTPROP_RE.match(first_line):
+    elif kind_of_line == "extprop":
         reason = "EXEC sp_addextendedproperty"
         otype = "metadata"
         category = "dont_translate"
-    elif _ADMIN_RE.match(first_line) or not first_line or first_line.startswith("--"):
+    elif kind_of_line in ("admin", "comment") or not first_line:
         reason = "Top-level admin/comment"
         otype = "admin"
         category = "dont_translate"
@@ -224,8 +347,13 @@ def _classify_part(part: Dict[str, Any]) -> Dict[str, Any]:
 
 # ---- Assembly helpers ----
 def _commentify(s: str) -> str:
-    lines = [ln.rstrip() for ln in s.splitlines()]
-    return "\n".join(f"-- {ln}" if ln.strip() else "--" for ln in lines)
+    # rstrip once; an rstripped line is blank only if it is empty
+    return "\n".join(f"-- {rs}" if rs else "--" for rs in map(str.rstrip, s.splitlines()))
+
+def _result_header(idx: int, res: Dict[str, Any]) -> str:
+    name = res.get("meta", {}).get("name") or f"part_{idx+1}"
+    otype = (res.get("meta", {}).get("type") or "UNKNOWN").upper()
+    return f"-- {name} ({otype})"
 
 def assemble_file_sql_only(parts_results: List[Dict[str, Any]]) -> str:
     """
@@ -234,34 +362,122 @@ def assemble_file_sql_only(parts_results: List[Dict[str, Any]]) -> str:
     """
     out: List[str] = []
     for idx, res in enumerate(parts_results):
-        name = res.get("meta", {}).get("name") or f"part_{idx+1}"
-        otype = (res.get("meta", {}).get("type") or "UNKNOWN").upper()
-        out.append(f"-- {name} ({otype})")  # short, one-line
+        out.append(_result_header(idx, res))  # short, one-line
         out.append(res["final_sql_clean"].rstrip())
         out.append("")  # blank line
     return "\n".join(out).rstrip() + "\n"
 
 # ---- Per-part translation ----
-def translate_part(part: Dict[str, Any], settings: Dict[str, Any], base: str, part_idx: int) -> Dict[str, Any]:
+_STAGE_GATES: Dict[str, threading.BoundedSemaphore] = {}
+_STAGE_GATES_LOCK = threading.Lock()
+
+def _stage_gate(stage: str, settings: Dict[str, Any]) -> threading.BoundedSemaphore:
+    """Semaphore bounding how many parts run `stage` at once."""
+    gate = _STAGE_GATES.get(stage)
+    if gate is None:
+        with _STAGE_GATES_LOCK:
+            gate = _STAGE_GATES.get(stage)
+            if gate is None:
+                n = (settings.get("stage_workers") or {}).get(stage, STAGE_WORKERS[stage])
+                gate = _STAGE_GATES[stage] = threading.BoundedSemaphore(max(1, int(n)))
+    return gate
+
+_WS_RE = re.compile(r"\s+")
+_RETRIEVE_CACHE: Dict[Tuple[str, bytes], Dict[str, Any]] = {}
+_RETRIEVE_CACHE_LOCK = threading.Lock()
+
+def _cached_retrieve(text: str, otype: str) -> Dict[str, Any]:
+    """
+    retrieve() with a small memo. Retrieval only looks at the lower-cased word
+    tokens of the query, so case/whitespace-only differences share one entry
+    (repeated boilerplate parts hit the vector store once).
+    """
+    key = _retrieve_key(text, otype)
+    hit = _RETRIEVE_CACHE.get(key)
+    if hit is not None:
+        return hit
+    r = retrieve(query=text, object_type=otype)
+    _remember_retrieve(key, r)
+    return r
+
+def _retrieve_key(text: str, otype: str) -> Tuple[str, bytes]:
+    norm = _WS_RE.sub(" ", text).strip().lower()
+    return (otype, hashlib.sha1(norm.encode("utf-8", errors="ignore")).digest())
+
+def _remember_retrieve(key: Tuple[str, bytes], r: Dict[str, Any]) -> None:
+    with _RETRIEVE_CACHE_LOCK:
+        if len(_RETRIEVE_CACHE) >= RETRIEVE_CACHE_MAX:
+            _RETRIEVE_CACHE.pop(next(iter(_RETRIEVE_CACHE)))  # oldest first
+        _RETRIEVE_CACHE[key] = r
+
+def _prepare_parts(parts: List[Dict[str, Any]]) -> List[Dict[str, Any] | None]:
+    """
+    Detector for every part, then one retrieve_batch over the queries not yet in the
+    retrieve memo (both stages are local; the LLM stages stay per part).
+    Returns detector results in input order. A part that fails here gets None and
+    translate_part runs (and reports) those stages itself.
+    """
     logger = _get_logger()
+    dets: List[Dict[str, Any] | None] = []
+    todo: Dict[Tuple[str, bytes], Tuple[str, str]] = {}
+    for p in parts:
+        try:
+            det = detect_object(p["text"])
+        except Exception as e:
+            logger.debug(f"detector failed up front for part_{_zero(p['idx'])}: {e}")
+            dets.append(None)
+            continue
+        dets.append(det)
+        otype = det.get("object_type") or p.get("object_type") or "unknown"
+        key = _retrieve_key(p["text"], otype)
+        if key not in _RETRIEVE_CACHE and key not in todo:
+            todo[key] = (p["text"], otype)
+    if todo:
+        try:
+            for key, r in zip(todo, retrieve_batch(list(todo.values()))):
+                _remember_retrieve(key, r)
+        except Exception as e:
+            logger.warning(f"retrieve_batch failed, retrieving per part: {e}")
+    return dets
+
+def _fallback_sql(text: str) -> str:
+    return (
+        f"-- ERROR: Failed translating part (see logs)\n"
+        f"/* Original T-SQL preserved: */\n{text}\n"
+    )
+
+def translate_part(part: Dict[str, Any], settings: Dict[str, Any], base: str, part_idx: int,
+                   det: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    logger = _get_logger()
+    pending: List[Tuple[Path, str]] = []  # artifacts flushed together at the end
     try:
-        det = detect_object(part["text"])
+        if det is None:
+            det = detect_object(part["text"])
         otype = det.get("object_type") or part.get("object_type") or "unknown"
-        _write_json("detector", base, f"part_{_zero(part_idx)}.json", det)
+        _write_json("detector", base, f"part_{_zero(part_idx)}.json", det, pending)
 
-        r = retrieve(query=part["text"], object_type=otype)
-        _write_json("retrieve", base, f"part_{_zero(part_idx)}.json", r)
+        with _stage_gate("retrieve", settings):
+            r = _cached_retrieve(part["text"], otype)
+        _write_json("retrieve", base, f"part_{_zero(part_idx)}.json", r, pending)
 
         model = settings.get("chat_deployment")
-        p1 = pass1_translate(part["text"], r, otype, model=model)
-        _write_text("translator_pass1", base, f"part_{_zero(part_idx)}.sql", p1["draft_sql"])
+        # settings["single_pass"] = true -> one LLM call per part (pass_combined) instead of two
+        single = bool(settings.get("single_pass"))
+        with _stage_gate("translator_pass1", settings):
+            p1 = (pass_combined if single else pass1_translate)(part["text"], r, otype, model=model)
+        _write_text("translator_pass1", base, f"part_{_zero(part_idx)}.sql", p1["draft_sql"], pending)
         _write_json("translator_pass1", base, f"part_{_zero(part_idx)}_meta.json",
-                    {"citations": p1["citations"], "todos": p1["todos"], "notes": p1["notes"], "retrieval_weak": p1["retrieval_weak"]})
+                    {"citations": p1["citations"], "todos": p1["todos"], "notes": p1["notes"], "retrieval_weak": p1["retrieval_weak"]}, pending)
 
-        sig = make_signals(p1["draft_sql"], otype)
-        _write_json("validator", base, f"part_{_zero(part_idx)}.json", sig)
+        # single pass: signals are a report on the final SQL; nothing left to repair
+        sig = make_signals(p1["final_sql"] if single else p1["draft_sql"], otype)
+        _write_json("validator", base, f"part_{_zero(part_idx)}.json", sig, pending)
 
-        p2 = pass2_repair(p1["draft_sql"], r, sig, otype, model=model)
+        if single:
+            p2 = p1
+        else:
+            with _stage_gate("translator_pass2", settings):
+                p2 = pass2_repair(p1["draft_sql"], r, sig, otype, model=model)
 
         # ---- NEW: build both variants ----
         clean_sql = p2["final_sql"]  # SQL-only
@@ -270,10 +486,11 @@ def translate_part(part: Dict[str, Any], settings: Dict[str, Any], base: str, pa
         )
 
         # Write both per-part artifacts
-        _write_text("translator_pass2", base, f"part_{_zero(part_idx)}.sql", clean_sql)            # clean
-        _write_text("translator_pass2", base, f"part_{_zero(part_idx)}_doc.sql", doc_sql)          # documented
+        _write_text("translator_pass2", base, f"part_{_zero(part_idx)}.sql", clean_sql, pending)   # clean
+        _write_text("translator_pass2", base, f"part_{_zero(part_idx)}_doc.sql", doc_sql, pending) # documented
         _write_json("translator_pass2", base, f"part_{_zero(part_idx)}_meta.json",
-                    {"applied_fixes": p2["applied_fixes"], "remaining_todos": p2["remaining_todos"]})
+                    {"applied_fixes": p2["applied_fixes"], "remaining_todos": p2["remaining_todos"]}, pending)
+        _flush_writes(pending)
 
         meta = {
             "name": det.get("name") or part.get("name"),
@@ -283,141 +500,222 @@ def translate_part(part: Dict[str, Any], settings: Dict[str, Any], base: str, pa
             "applied_fixes": p2["applied_fixes"],
             "retrieval_weak": bool(r.get("retrieval_weak", False)),
         }
+        # LLM disabled/unreachable: the part holds a pass-through draft (or an unrepaired
+        # one); the file must not count as clean on the next run
+        degraded = bool(p1.get("model_unavailable") or p2.get("model_unavailable"))
+        if degraded:
+            logger.warning(f"{base} part_{_zero(part_idx)}: model unavailable, output is a conservative pass-through")
         # Return both variants
-        return {"ok": True, "final_sql_clean": clean_sql, "final_sql_doc": doc_sql, "meta": meta}
+        return {"ok": True, "degraded": degraded, "final_sql_clean": clean_sql, "final_sql_doc": doc_sql, "meta": meta}
 
     except Exception as e:
         logger.error(f"translate_part failed: {e}")
-        fallback = (
-            f"-- ERROR: Failed translating part (see logs)\n"
-            f"/* Original T-SQL preserved: */\n{part['text']}\n"
-        )
+        try:
+            _flush_writes(pending)  # keep whatever stages completed
+        except Exception as we:
+            logger.error(f"artifact flush failed: {we}")
+        fallback = _fallback_sql(part["text"])
         _write_text("translator_pass2", base, f"part_{_zero(part_idx)}.sql", fallback)
         _write_json("translator_pass2", base, f"part_{_zero(part_idx)}_meta.json", {"error": str(e)})
         return {"ok": False, "final_sql_clean": fallback, "final_sql_doc": fallback, "meta": {"error": str(e)}}
 
 # ---- End-to-end ----
-def process_all_inputs() -> Dict[str, Any]:
+def _run_signature(settings: Dict[str, Any]) -> str:
+    """SHA-1 of everything besides the input bytes that shapes a file's output: settings, embeddings store, prompts."""
+    sig = {k: settings.get(k) for k in OUTPUT_SETTINGS_KEYS}
+    sig["embeddings"] = store_signature()
+    sig["prompts"] = prompt_signature()
+    return hashlib.sha1(json.dumps(sig, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _cached_report(base: str, input_sha: str, run_sig: str) -> Dict[str, Any] | None:
+    """Previous manifest for base if it was built from the same bytes and run signature, cleanly, and its outputs still exist."""
+    mf = MANIFESTS / f"{base}.json"
+    try:
+        rep = json.loads(mf.read_bytes())
+    except (OSError, ValueError):
+        return None
+    if rep.get("input_sha") != input_sha or rep.get("run_sig") != run_sig:
+        return None
+    # failed or model-less parts are retried; manifests without the count predate it
+    if rep.get("fallback_parts") or rep.get("degraded_parts", 1):
+        return None
+    output, not_translated = rep.get("output"), rep.get("not_translated")
+    if not (output and not_translated and Path(output).exists() and Path(not_translated).exists()):
+        return None
+    return rep
+
+def _split_file(base: str, raw: str) -> Dict[str, Any]:
+    """Clean this base's stage dirs, split + classify, and write the splitter artifacts."""
+    # Clean stage dirs for this base to allow overwrite on re-run
+    for stage in STAGES:
+        _stage_dir(stage, base, clean=True)
+    _ensure_dir(MANIFESTS)
+    _ensure_dir(FINAL_DIR / base)  # for not_translated.sql
+
+    # Split
+    parts = split_into_objects(raw)
+
+    # Classify + write splitter artifacts
+    split_dir = _stage_dir("splitter", base)
+    _ensure_dir(split_dir / "translate")
+    _ensure_dir(split_dir / "dont_translate")
+
+    parts_index: List[Dict[str, Any]] = []
+    preamble_chunks: List[str] = []
+    translate_parts: List[Dict[str, Any]] = []
+    dont_parts: List[Dict[str, Any]] = []
+
+    # split_into_objects emits parts in span_index order already
+    for i, p in enumerate(parts):
+        idx = i + 1
+        classified = _classify_part(p)
+        classified["idx"] = idx  # stable index for filenames
+
+        # Save raw part text to the appropriate splitter subfolder
+        if classified["category"] == "translate":
+            (split_dir / "translate" / f"part_{_zero(idx)}.sql").write_text(
+                classified["text"], encoding="utf-8"
+            )
+            translate_parts.append(classified)
+        else:
+            (split_dir / "dont_translate" / f"part_{_zero(idx)}.sql").write_text(
+                classified["text"], encoding="utf-8"
+            )
+            dont_parts.append(classified)
+            if classified.get("preamble"):
+                preamble_chunks.append(classified.get("text", ""))
+
+        parts_index.append({
+            "idx": idx,
+            "span_index": classified["span_index"],
+            "object_type": classified["object_type"],
+            "category": classified["category"],
+            "reason": classified["reason"],
+            "name": classified.get("name"),
+            "file_offset": classified["span_index"]
+        })
+
+    _write_json("splitter", base, "parts.json", parts_index)
+    preamble_text = "\n".join(preamble_chunks) + ("\n" if preamble_chunks else "")
+    if preamble_text.strip():
+        (split_dir / "preamble.sql").write_text(preamble_text, encoding="utf-8")
+
+    return {"parts_index": parts_index, "translate_parts": translate_parts, "dont_parts": dont_parts}
+
+def _translate_jobs(jobs: List[Dict[str, Any]], settings: Dict[str, Any]) -> None:
+    """
+    Translate the "translate" parts of every pending file on one shared pool, so a
+    directory of one-object scripts overlaps its LLM calls just like a multi-part file.
+    Fills job["results"] in part order.
+    """
+    logger = _get_logger()
+    work = [(job, p) for job in jobs for p in job["translate_parts"]]
+    for job in jobs:
+        job["results"] = []
+    if not work:
+        return
+    workers = max(1, min(int(settings.get("max_parallel_parts", MAX_PARALLEL_PARTS)), len(work)))
+    dets = _prepare_parts([p for _, p in work])
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(translate_part, p, settings, job["base"], p["idx"], det)
+                   for (job, p), det in zip(work, dets)]
+        for (job, part), fut in zip(work, futures):
+            try:
+                out = fut.result()
+            except Exception as e:
+                logger.error(f"translate_part crashed on {job['base']} part_{_zero(part['idx'])}: {e}")
+                fallback = _fallback_sql(part["text"])
+                out = {"ok": False, "final_sql_clean": fallback, "final_sql_doc": fallback, "meta": {"error": str(e)}}
+            job["results"].append(out)
+
+def _finish_file(job: Dict[str, Any], model: Any, run_sig: str) -> Dict[str, Any]:
+    """Write the final outputs + manifest for one translated file; returns its report."""
+    logger = _get_logger()
+    base, results, dont_parts = job["base"], job["results"], job["dont_parts"]
+
+    # Build not_translated.sql (final/<base>/not_translated.sql)
+    not_translated_path = FINAL_DIR / base / "not_translated.sql"
+    _write_sql_blocks(not_translated_path,
+                      ((f"-- part_{_zero(p['idx'])}: {p['reason']}", p["text"]) for p in dont_parts))
+
+    # ---- NEW: assemble clean SQL-only final file
+    final_sql_clean = assemble_file_sql_only(results)
+    out_path = write_final_output(base, final_sql_clean)
+
+    # ---- NEW: also write a documented version (optional)
+    explain_path = FINAL_DIR / base / "explain_summary.sql"
+    _write_sql_blocks(explain_path,
+                      ((_result_header(idx, r), r["final_sql_doc"]) for idx, r in enumerate(results)))
+
+    logger.info(f"Wrote final(clean): {out_path.as_posix()}  |  documented: {explain_path.as_posix()}  |  not-translated: {not_translated_path.as_posix()}")
+
+    file_report = {
+        "input": job["path"].as_posix(),
+        "output": out_path.as_posix(),
+        "not_translated": not_translated_path.as_posix(),
+        "parts_total": len(job["parts_index"]),
+        "translate_parts": len(job["translate_parts"]),
+        "dont_translate_parts": len(dont_parts),
+        "ok_parts": sum(1 for r in results if r["ok"]),
+        "fallback_parts": sum(1 for r in results if not r["ok"]),
+        "degraded_parts": sum(1 for r in results if r.get("degraded")),
+        "stage_paths": {k: (v / base).as_posix() for k, v in STAGES.items()},
+        "splitter_path": (STAGES["splitter"] / base).as_posix(),
+        "input_sha": job["input_sha"],
+        "model": model,
+        "run_sig": run_sig,
+    }
+    (MANIFESTS / f"{base}.json").write_text(_json_dumps(file_report), encoding="utf-8")
+    return file_report
+
+def process_all_inputs(force: bool = False) -> Dict[str, Any]:
+    """
+    Run every scripts_input/*.sql through the pipeline. A file whose bytes and run
+    signature (output settings, embeddings store, prompts) match its last manifest is
+    skipped and reported from that manifest, unless that run had failed or model-less
+    parts; force=True re-runs everything.
+    Files are split first, then all their parts are translated on one shared pool,
+    then each file's outputs are written.
+    """
     logger = _get_logger()
     settings = _load_settings()
     files = list_input_files()
+    _RETRIEVE_CACHE.clear()  # embeddings may have been rebuilt since the last run
+    _MKDIR_CACHE.clear()     # output folders may have been removed by hand
     summary: Dict[str, Any] = {"files": [], "total_inputs": len(files)}
     logger.info(f"Discovered {len(files)} input file(s) in {INPUT_DIR.as_posix()}")
+    model = settings.get("chat_deployment")
+    run_sig = _run_signature(settings)
 
+    reports: List[Dict[str, Any] | None] = []
+    jobs: List[Dict[str, Any]] = []
     for f in files:
         base = f.stem
+        data = f.read_bytes()
+        input_sha = hashlib.sha1(data).hexdigest()
+        cached = None if force else _cached_report(base, input_sha, run_sig)
+        if cached is not None:
+            logger.info(f"Unchanged: {base}.sql (same input as last run); skipping")
+            reports.append(cached)
+            continue
         logger.info(f"Processing: {base}.sql")
-        raw = read_sql_file(f)
-
-        # Clean stage dirs for this base to allow overwrite on re-run
-        for stage in STAGES:
-            _stage_dir(stage, base, clean=True)
-        MANIFESTS.mkdir(parents=True, exist_ok=True)
-        (FINAL_DIR / base).mkdir(parents=True, exist_ok=True)  # for not_translated.sql
-
-        # Split
-        parts = split_into_objects(raw)
-
-        # Classify + write splitter artifacts
-        split_dir = _stage_dir("splitter", base)
-        (split_dir / "translate").mkdir(parents=True, exist_ok=True)
-        (split_dir / "dont_translate").mkdir(parents=True, exist_ok=True)
-
-        parts_index: List[Dict[str, Any]] = []
-        preamble_text = ""
-        translate_parts: List[Dict[str, Any]] = []
-        dont_parts: List[Dict[str, Any]] = []
-
-        for i, p in enumerate(sorted(parts, key=lambda x: x["span_index"])):
-            idx = i + 1
-            classified = _classify_part(p)
-            classified["idx"] = idx  # stable index for filenames
-
-            # Save raw part text to the appropriate splitter subfolder
-            if classified["category"] == "translate":
-                (split_dir / "translate").mkdir(exist_ok=True)
-                (split_dir / "translate" / f"part_{_zero(idx)}.sql").write_text(
-                    classified["text"], encoding="utf-8"
-                )
-                translate_parts.append(classified)
-            else:
-                (split_dir / "dont_translate").mkdir(exist_ok=True)
-                (split_dir / "dont_translate" / f"part_{_zero(idx)}.sql").write_text(
-                    classified["text"], encoding="utf-8"
-                )
-                dont_parts.append(classified)
-                if classified.get("preamble"):
-                    preamble_text += (classified.get("text", "") + "\n")
-
-            parts_index.append({
-                "idx": idx,
-                "span_index": classified["span_index"],
-                "object_type": classified["object_type"],
-                "category": classified["category"],
-                "reason": classified["reason"],
-                "name": classified.get("name"),
-                "file_offset": classified["span_index"]
-            })
-
-        _write_json("splitter", base, "parts.json", parts_index)
-        if preamble_text.strip():
-            (split_dir / "preamble.sql").write_text(preamble_text, encoding="utf-8")
-
-        # Translate only "translate" parts
-        results: List[Dict[str, Any]] = []
-        for part in translate_parts:
-            out = translate_part(part, settings, base, part["idx"])
-            results.append(out)
-
-        # Build not_translated.sql (final/<base>/not_translated.sql)
-        non_translated_summary = [{"idx": p["idx"], "reason": p["reason"]} for p in dont_parts]
-        not_translated_path = FINAL_DIR / base / "not_translated.sql"
-        lines = []
-        for p in dont_parts:
-            lines.append(f"-- part_{_zero(p['idx'])}: {p['reason']}")
-            lines.append(p["text"].rstrip())
-            lines.append("")  # blank line
-        not_translated_path.write_text("\n".join(lines).rstrip() + "\n", encoding="utf-8")
-
-        # ---- NEW: assemble clean SQL-only final file
-        final_sql_clean = assemble_file_sql_only(results)
-        out_path = write_final_output(base, final_sql_clean)
-
-        # ---- NEW: also write a documented version (optional)
-        explain_path = FINAL_DIR / base / "explain_summary.sql"
-        doc_lines = []
-        for idx, r in enumerate(results):
-            name = r.get("meta", {}).get("name") or f"part_{idx+1}"
-            otype = (r.get("meta", {}).get("type") or "UNKNOWN").upper()
-            doc_lines.append(f"-- {name} ({otype})")
-            doc_lines.append(r["final_sql_doc"].rstrip())
-            doc_lines.append("")
-        explain_path.write_text("\n".join(doc_lines).rstrip() + "\n", encoding="utf-8")
-
-        logger.info(f"Wrote final(clean): {out_path.as_posix()}  |  documented: {explain_path.as_posix()}  |  not-translated: {not_translated_path.as_posix()}")
-
-        file_report = {
-            "input": f.as_posix(),
-            "output": out_path.as_posix(),
-            "not_translated": not_translated_path.as_posix(),
-            "parts_total": len(parts_index),
-            "translate_parts": len(translate_parts),
-            "dont_translate_parts": len(dont_parts),
-            "ok_parts": sum(1 for r in results if r["ok"]),
-            "fallback_parts": sum(1 for r in results if not r["ok"]),
-            "stage_paths": {k: (v / base).as_posix() for k, v in STAGES.items()},
-            "splitter_path": (STAGES["splitter"] / base).as_posix()
-        }
-        (MANIFESTS / f"{base}.json").write_text(json.dumps(file_report, indent=2), encoding="utf-8")
-        summary["files"].append(file_report)
+        job = _split_file(base, _decode_sql(data))
+        job.update(path=f, base=base, input_sha=input_sha, slot=len(reports))
+        reports.append(None)
+        jobs.append(job)
+
+    _translate_jobs(jobs, settings)
 
+    for job in jobs:
+        reports[job["slot"]] = _finish_file(job, model, run_sig)
+    summary["files"] = reports
     return summary
 
 # ---- CLI ----
 if __name__ == "__main__":
     log = _get_logger()
     try:
-        rep = process_all_inputs()
+        rep = process_all_inputs(force="--force" in sys.argv[1:])
         print(f"[Phase 4] Orchestrator finished. files={rep['total_inputs']}")
     except Exception as e:
         log.error(f"Fatal error in orchestrator: {e}")
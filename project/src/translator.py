@@ -7,31 +7,56 @@
 # Logging: creates C:\Users\CatherineVaras\Downloads\snowflake\logs\translator.log if missing.
 
 from __future__ import annotations
+import hashlib
 import json
+import os
 import re
 import logging
+import logging.handlers
+import functools
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional, Iterator
+
+try:
+    import orjson  # optional: C-accelerated JSON for the pass2 guide
+except ImportError:
+    orjson = None
+
+try:
+    import httpx  # ships with openai; used for per-phase timeouts
+    from openai import AzureOpenAI, APIStatusError  # requires openai>=1.0; without it the LLM is disabled
+except ImportError:
+    httpx = None
+    AzureOpenAI = None
+    APIStatusError = None
 
 # -------- Fixed paths --------
 LOG_FILE = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project\logs\translator.log"
 SETTINGS_PATH = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project\settings.json"
+# LLM responses keyed by sha256(model + prompt + params); delete the folder to force fresh calls
+LLM_CACHE_DIR = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project\cache\translator_llm"
 
 # -------- Logger --------
+@functools.lru_cache(maxsize=1)
 def _get_logger() -> logging.Logger:
     logger = logging.getLogger("translator_phase4")
-    if getattr(logger, "_configured", False):
+    if getattr(logger, "_configured", False):  # handlers survive a module reload
         return logger
     logger.setLevel(logging.DEBUG)
     log_path = Path(LOG_FILE)
     log_path.parent.mkdir(parents=True, exist_ok=True)
-    fh = logging.FileHandler(log_path, mode="a", encoding="utf-8")
+    fh = logging.FileHandler(log_path, mode="a", encoding="utf-8", delay=True)
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+    # Buffer file writes: flush every 64 records or at once on WARNING+;
+    # logging.shutdown() (atexit) flushes the rest.
+    mh = logging.handlers.MemoryHandler(64, flushLevel=logging.WARNING, target=fh)
+    mh.setLevel(logging.DEBUG)
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
     ch.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
-    logger.addHandler(fh)
+    logger.addHandler(mh)
     logger.addHandler(ch)
     logger._configured = True  # type: ignore[attr-defined]
     logger.debug("translator logger initialized")
@@ -40,38 +65,85 @@ def _get_logger() -> logging.Logger:
 # -------- Settings / Azure client --------
 def _load_settings(path: str = SETTINGS_PATH) -> dict:
     p = Path(path)
-    if not p.exists():
+    try:
+        mtime_ns = p.stat().st_mtime_ns
+    except OSError:
         raise FileNotFoundError(f"settings.json not found at {p}")
-    return json.loads(p.read_text(encoding="utf-8"))
+    return _read_settings(str(p), mtime_ns)
+
+@functools.lru_cache(maxsize=4)
+def _read_settings(path: str, mtime_ns: int) -> dict:
+    """Parsed settings.json, re-read only when the file changes."""
+    return json.loads(Path(path).read_bytes())  # bytes: json detects UTF-8/16 and tolerates a BOM
+
+# One AzureOpenAI client per (api_key, endpoint, timeout, retries): keeps its HTTP connection pool warm
+_CLIENT: Dict[Tuple[Any, ...], Any] = {}
+_CLIENT_LOCK = threading.Lock()
+# A stalled request must not hold a part (and its stage slot) forever; the SDK
+# retries connection errors, 408/429/5xx with exponential backoff.
+LLM_READ_TIMEOUT_S = 120.0
+LLM_MAX_RETRIES = 3
+# 4xx the SDK does retry; any other 4xx (bad key, unknown deployment, rejected content)
+# will fail the same way on every part and every rerun
+_RETRYABLE_4XX = (408, 409, 429)
+
+def _is_permanent_llm_error(e: Exception) -> bool:
+    if APIStatusError is None or not isinstance(e, APIStatusError):
+        return False
+    status = getattr(e, "status_code", 0) or 0
+    return 400 <= status < 500 and status not in _RETRYABLE_4XX
 
 def _get_azure_client():
-    # Lazy import to keep module importable without the package
-    from openai import AzureOpenAI
+    if AzureOpenAI is None:
+        raise ImportError("openai package not installed (pip install openai>=1.0)")
     settings = _load_settings()
-    client = AzureOpenAI(
-        api_key=settings["api_key"],
-        api_version="2024-12-01-preview",
-        azure_endpoint=settings["azure_endpoint"],
-    )
+    read_timeout = float(settings.get("llm_timeout_s", LLM_READ_TIMEOUT_S))
+    retries = int(settings.get("llm_max_retries", LLM_MAX_RETRIES))
+    key = (settings["api_key"], settings["azure_endpoint"], read_timeout, retries)
+    client = _CLIENT.get(key)
+    if client is None:
+        with _CLIENT_LOCK:
+            client = _CLIENT.get(key)
+            if client is None:
+                client = AzureOpenAI(
+                    api_key=settings["api_key"],
+                    api_version="2024-12-01-preview",
+                    azure_endpoint=settings["azure_endpoint"],
+                    timeout=httpx.Timeout(read_timeout, connect=5.0),
+                    max_retries=retries,
+                )
+                _CLIENT.clear()  # settings changed: drop the stale client
+                _CLIENT[key] = client
     return client, settings
 
 # -------- Small helpers --------
 def _extract_citations(retrieved: Dict[str, Any], cap: int = 8) -> List[str]:
     items = retrieved.get("chunks", []) or []
     cites = []
+    seen = set()  # O(1) membership so a larger cap stays linear
     for ch in items[:cap]:
         c = ch.get("citation")
-        if c and c not in cites:
+        if c and c not in seen:
+            seen.add(c)
             cites.append(c)
     return cites
 
-_TODO_RE = re.compile(r"(?im)^\s*--\s*TODO:.*$")
+@functools.lru_cache(maxsize=256)
+def _format_citations_block(cites: Tuple[str, ...]) -> str:
+    """Prompt bullet list of citation titles; parts retrieving the same sections share it."""
+    return "\n".join(f"- {c}" for c in cites) if cites else "- (no relevant sections)"
+
+# group 1 is the TODO without surrounding blanks, so matches need no .strip()
+_TODO_RE = re.compile(r"(?im)^[^\S\n]*(--\s*TODO:.*?)[^\S\n]*$")
 
 def _scan_todos(sql: str) -> List[str]:
-    return [m.group(0).strip() for m in _TODO_RE.finditer(sql)]
+    # findall hands back the trimmed group directly, no Match objects
+    if "--" not in sql:
+        return []
+    return _TODO_RE.findall(sql)
 
 def _strip_trailing_semicolons(sql: str) -> str:
-    return re.sub(r"[ \t]*;[ \t]*$", "", sql.strip())
+    return sql.rstrip().rstrip(";").rstrip()
 
 def _ensure_ends_with_semicolon(sql: str) -> str:
     s = sql.rstrip()
@@ -83,49 +155,179 @@ def _ensure_ends_with_semicolon(sql: str) -> str:
 # - If a LIMIT already exists, do nothing.
 # - Appends LIMIT at the end of the outer-most query (naive but safe-ish for views).
 _TOP_RE = re.compile(r"(?is)^\s*SELECT\s+TOP\s+(\d+)\s+", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\s+\d+\b", re.IGNORECASE)
 
 def _apply_safe_fixes(sql: str, object_type: Optional[str], applied: List[str]) -> str:
     s = sql
+    # TOP->LIMIT needs a leading SELECT; most drafts (CREATE ...) bail out here
+    # without running either regex
+    if s.lstrip()[:6].upper() != "SELECT":
+        return s
     # Avoid double-limiting
-    if re.search(r"(?i)\bLIMIT\s+\d+\b", s):
-        pass
-    else:
-        m = _TOP_RE.search(s)
-        if m and (object_type == "view" or object_type is None):
-            n = m.group(1)
-            # remove TOP N token
-            s = _TOP_RE.sub("SELECT ", s, count=1)
-            # append LIMIT N to the outer statement
-            s = _strip_trailing_semicolons(s)
-            s = s + f"\nLIMIT {n};"
-            applied.append("TOP→LIMIT")
+    if _LIMIT_RE.search(s):
+        return s
+    m = _TOP_RE.match(s)
+    if m and (object_type == "view" or object_type is None):
+        n = m.group(1)
+        # remove TOP N token (the match is the whole "SELECT TOP n " prefix)
+        s = "SELECT " + s[m.end():]
+        # append LIMIT N to the outer statement
+        s = _strip_trailing_semicolons(s)
+        s = s + f"\nLIMIT {n};"
+        applied.append("TOP→LIMIT")
     return s
 
-def _llm_chat(messages: List[Dict[str, str]], model: Optional[str]) -> str:
-    logger = _get_logger()
-    if not model:
-        # Try settings.json
+def _analyze_sql(sql: str, object_type: Optional[str],
+                 todos: Optional[List[str]] = None) -> Tuple[str, List[str]]:
+    """
+    Final hygiene + TODO scan in one step -> (final_sql, remaining_todos).
+    `todos` are the already-scanned TODOs of `sql`, reused when hygiene leaves the text as is.
+    """
+    s = sql.strip()
+    # Ensure one terminal semicolon for single statements (best-effort; safe for views)
+    if object_type == "view":
+        s = _ensure_ends_with_semicolon(_strip_trailing_semicolons(s))
+    if todos is None or s != sql:
+        todos = _scan_todos(s)
+    return s, todos
+
+# T-SQL constructs spotted in the source itself, so a single call can translate
+# and repair without waiting for validator signals on a draft
+_STATIC_HINTS = (
+    (re.compile(r"\bTOP\s*\(?\s*\d+", re.IGNORECASE), "TOP n → LIMIT n at the end of the outer SELECT."),
+    (re.compile(r"\bISNULL\s*\(", re.IGNORECASE), "ISNULL(a, b) → COALESCE(a, b)."),
+    (re.compile(r"\b(?:GETDATE|GETUTCDATE)\s*\(", re.IGNORECASE), "GETDATE()/GETUTCDATE() → CURRENT_TIMESTAMP(); cast explicitly to TIMESTAMP_NTZ/TZ or DATE."),
+    (re.compile(r"\[[^\]\n]+\]"), "[bracketed] identifiers → plain identifiers."),
+    (re.compile(r"\bOVER\s*\(", re.IGNORECASE), "Windowed expressions: use QUALIFY only when filtering on them."),
+    (re.compile(r"\bBEGIN\s+TRY\b", re.IGNORECASE), "TRY/CATCH → EXCEPTION WHEN OTHER THEN ..."),
+)
+
+def _static_hints(input_sql: str) -> List[str]:
+    return [hint for rx, hint in _STATIC_HINTS if rx.search(input_sql)]
+
+def _compact_json(obj: Any) -> str:
+    """Compact JSON for prompts: no indentation, the model doesn't need it and it costs tokens."""
+    if orjson is not None:
         try:
-            _, settings = _get_azure_client()
-            model = settings.get("chat_deployment")
-        except Exception as e:
-            logger.warning(f"LLM disabled: {e}")
-            return ""
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass  # e.g. ints beyond 64 bits; let stdlib handle it
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+LLM_TEMPERATURE = 0.1
+# Output budget: ~4 chars per token, scaled by how much the text may grow
+# (an answer cut at that budget is re-asked once at MAX_TOKENS_CAP, see _llm_chat)
+MAX_TOKENS_CAP = 2000
+MAX_TOKENS_FLOOR = 512
+
+def _max_tokens_for(text: str, growth: float) -> int:
+    return min(MAX_TOKENS_CAP, max(MAX_TOKENS_FLOOR, int(len(text) / 4 * growth)))
+
+def _llm_chat_stream(client: Any, deployment: str, messages: List[Dict[str, str]],
+                     max_tokens: int = MAX_TOKENS_CAP,
+                     finish: Optional[List[str]] = None) -> Iterator[str]:
+    """
+    Yield the completion text as it arrives (stream=True), for callers that want progress.
+    The finish reason ("stop", "length", ...) is appended to `finish` when given.
+    """
+    resp = client.chat.completions.create(
+        model=deployment,
+        messages=messages,
+        temperature=LLM_TEMPERATURE,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    for chunk in resp:
+        # Azure puts content-filter results in chunks without choices
+        if chunk.choices:
+            choice = chunk.choices[0]
+            piece = choice.delta.content
+            if piece:
+                yield piece
+            reason = getattr(choice, "finish_reason", None)
+            if reason and finish is not None:
+                finish.append(reason)
+
+# -------- LLM response cache (disk) --------
+def _llm_cache_file(deployment: str, messages: List[Dict[str, str]], max_tokens: int) -> Path:
+    """Content-addressed cache file for this exact request."""
+    key = hashlib.sha256(json.dumps([deployment, LLM_TEMPERATURE, max_tokens, messages],
+                                    ensure_ascii=False).encode("utf-8")).hexdigest()
+    return Path(LLM_CACHE_DIR) / f"{key}.json"
+
+def _read_llm_cache(path: Path) -> Optional[str]:
+    try:
+        entry = json.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    # Entries without a finish reason predate the truncation check: treat as a miss
+    if entry.get("finish_reason") in (None, "length"):
+        return None
+    return entry.get("content") or None
+
+def _write_llm_cache(path: Path, content: str, finish_reason: str) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"content": content, "finish_reason": finish_reason},
+                                  ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)  # atomic, parallel parts may race on the same prompt
+    except OSError as e:
+        _get_logger().warning(f"LLM cache write failed: {e}")
+
+def _llm_chat(messages: List[Dict[str, str]], model: Optional[str],
+              max_tokens: int = MAX_TOKENS_CAP) -> str:
+    logger = _get_logger()
     try:
         client, settings = _get_azure_client()
-        deployment = model or settings.get("chat_deployment")
-        if not deployment:
-            return ""
+    except Exception as e:
+        logger.warning(f"LLM disabled: {e}")
+        return ""
+    # Explicit model wins; otherwise the deployment from settings.json
+    deployment = model or settings.get("chat_deployment")
+    if not deployment:
+        return ""
+    # Same request as an earlier run -> reuse that answer instead of a new LLM call
+    cache_file = _llm_cache_file(deployment, messages, max_tokens) if settings.get("response_cache", True) else None
+    if cache_file is not None:
+        cached = _read_llm_cache(cache_file)
+        if cached is not None:
+            logger.debug(f"LLM cache hit {cache_file.name}")
+            return cached
+    try:
+        content, finish_reason = _llm_request(client, deployment, messages, max_tokens, settings)
+        if finish_reason == "length" and max_tokens < MAX_TOKENS_CAP:
+            # The size estimate was too tight for this part: one more try at the full budget
+            logger.warning(f"LLM output cut at max_tokens={max_tokens}; retrying with {MAX_TOKENS_CAP}")
+            content, finish_reason = _llm_request(client, deployment, messages, MAX_TOKENS_CAP, settings)
+    except Exception as e:
+        logger.error(f"LLM call failed: {e}")
+        if _is_permanent_llm_error(e):
+            raise  # not a transient outage: fail the part instead of a pass-through draft
+        return ""
+    if finish_reason == "length":
+        # Half a script is worse than none: fail the part (never cached, a rerun retries it)
+        raise RuntimeError(f"LLM output truncated at max_tokens={MAX_TOKENS_CAP}")
+    if content and cache_file is not None:
+        _write_llm_cache(cache_file, content, finish_reason or "stop")  # empty/failed answers are never cached
+    return content
+
+def _llm_request(client: Any, deployment: str, messages: List[Dict[str, str]],
+                 max_tokens: int, settings: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """-> (content, finish_reason)"""
+    # settings["stream"] = false for gateways/proxies that don't support SSE
+    if not settings.get("stream", True):
         resp = client.chat.completions.create(
             model=deployment,
             messages=messages,
-            temperature=0.1,
-            max_tokens=2000,
+            temperature=LLM_TEMPERATURE,
+            max_tokens=max_tokens,
         )
-        return (resp.choices[0].message.content or "").strip()
-    except Exception as e:
-        logger.error(f"LLM call failed: {e}")
-        return ""
+        choice = resp.choices[0]
+        return (choice.message.content or "").strip(), getattr(choice, "finish_reason", None)
+    finish: List[str] = []
+    content = "".join(_llm_chat_stream(client, deployment, messages, max_tokens, finish)).strip()
+    return content, (finish[-1] if finish else None)
 
 def _normalize_object_type(object_type: Optional[str]) -> str:
     if not object_type:
@@ -139,28 +341,12 @@ def _normalize_object_type(object_type: Optional[str]) -> str:
     return "unknown"
 
 
-def _build_pass1_system_prompt(object_type: Optional[str]) -> str:
-    """Devuelve un system prompt especializado por tipo de objeto."""
-    otype = _normalize_object_type(object_type)
+# Role line that opens every procedure/unknown prompt, identical in both passes so
+# it and _PROCEDURE_RULES right after it form a shared prefix for the prompt cache
+_PROMPT_ROLE = "You convert SQL Server (T-SQL) objects into Snowflake SQL.\n"
 
-    header = (
-        "You translate to Snowflake.\n"
-        "OUTPUT CONTRACT (must follow exactly):\n"
-        "- Return a SINGLE executable Snowflake script. No explanations. No markdown fences.\n"
-    )
-
-    view_rules = (
-        "VIEW RULES:\n"
-        "- Output MUST start with: CREATE OR REPLACE VIEW <schema>.<name> [COPY GRANTS]\n"
-        "- Then the keyword AS on its own line, then a SELECT body, then a single semicolon.\n"
-        "- Never return a bare SELECT.\n"
-        "- Prefer unquoted identifiers unless quoted/mixed-case exists in the source; preserve explicit schema qualifiers in FROM/JOIN.\n"
-        "- Keep semantics exactly (columns, filters, windowing). Use QUALIFY only when strictly required (e.g., to deduplicate ties with ROW_NUMBER).\n"
-        "\n"
-    )
-
-        
-    procedure_rules = """
+# Shared by pass1 and pass2 (after _PROMPT_ROLE in their procedure prompts)
+_PROCEDURE_RULES = """
     PROCEDURE RULES (Snowflake SQL language — strict, safe, non-inventive):
 
     GENERAL STRUCTURE
@@ -247,6 +433,28 @@ def _build_pass1_system_prompt(object_type: Optional[str]) -> str:
 
     """
 
+def _build_pass1_system_prompt(object_type: Optional[str]) -> str:
+    """Devuelve un system prompt especializado por tipo de objeto."""
+    return _pass1_system_prompt(_normalize_object_type(object_type))
+
+@functools.lru_cache(maxsize=None)
+def _pass1_system_prompt(otype: str) -> str:
+    # Built once per normalized type ("view" | "procedure" | "unknown")
+    header = (
+        "You translate to Snowflake.\n"
+        "OUTPUT CONTRACT (must follow exactly):\n"
+        "- Return a SINGLE executable Snowflake script. No explanations. No markdown fences.\n"
+    )
+
+    view_rules = (
+        "VIEW RULES:\n"
+        "- Output MUST start with: CREATE OR REPLACE VIEW <schema>.<name> [COPY GRANTS]\n"
+        "- Then the keyword AS on its own line, then a SELECT body, then a single semicolon.\n"
+        "- Never return a bare SELECT.\n"
+        "- Prefer unquoted identifiers unless quoted/mixed-case exists in the source; preserve explicit schema qualifiers in FROM/JOIN.\n"
+        "- Keep semantics exactly (columns, filters, windowing). Use QUALIFY only when strictly required (e.g., to deduplicate ties with ROW_NUMBER).\n"
+        "\n"
+    )
 
     general_rules = (
         "GENERAL RULES:\n"
@@ -261,29 +469,35 @@ def _build_pass1_system_prompt(object_type: Optional[str]) -> str:
         # Sólo reglas de VIEW + generales
         return header + view_rules + general_rules
     elif otype == "procedure":
-        # Sólo reglas de PROCEDURE + generales
-        return header + procedure_rules + general_rules
+        # Sólo reglas de PROCEDURE + generales. Role + rules lead: byte-identical
+        # in pass1 and pass2, so the service's prompt cache can reuse them across passes.
+        return _PROMPT_ROLE + _PROCEDURE_RULES + header + general_rules
     else:
-        # Desconocido: incluye ambos bloques
-        return header + view_rules + procedure_rules + general_rules
+        # Desconocido: incluye ambos bloques (shared PROCEDURE block first, as above)
+        return _PROMPT_ROLE + _PROCEDURE_RULES + header + view_rules + general_rules
 
 
+_SAFE_FIXES_RULES = (
+    "SAFE FIXES (applies to all objects):\n"
+    "- Apply validator suggestions when unambiguous (e.g., TOP→LIMIT, use QUALIFY for tie-breaking if needed, bracket→identifier, function equivalences).\n"
+    "- Preserve semantics and explicit schema qualification; do not invent columns/tables.\n"
+    "- If anything remains uncertain, keep original and add '-- TODO:' explaining the ambiguity.\n"
+    "- Ensure final output compiles in Snowflake as-is.\n"
+)
+
 def _build_pass2_system_prompt(object_type: Optional[str]) -> str:
     """Devuelve un system prompt especializado para la fase de reparación."""
-    otype = _normalize_object_type(object_type)
+    return _pass2_system_prompt(_normalize_object_type(object_type))
 
+@functools.lru_cache(maxsize=None)
+def _pass2_system_prompt(otype: str) -> str:
+    # Built once per normalized type ("view" | "procedure" | "unknown")
     header = (
         "You are a careful Snowflake SQL fixer. Normalize/repair the input into ONE executable Snowflake script if needed if not don't and just return the same input.\n"
         "No explanations. No markdown fences.\n\n"
     )
 
-    generic_requirements = (
-        "SAFE FIXES (applies to all objects):\n"
-        "- Apply validator suggestions when unambiguous (e.g., TOP→LIMIT, use QUALIFY for tie-breaking if needed, bracket→identifier, function equivalences).\n"
-        "- Preserve semantics and explicit schema qualification; do not invent columns/tables.\n"
-        "- If anything remains uncertain, keep original and add '-- TODO:' explaining the ambiguity.\n"
-        "- Ensure final output compiles in Snowflake as-is.\n"
-    )
+    generic_requirements = _SAFE_FIXES_RULES
 
     view_requirements = (
         "HARD REQUIREMENTS FOR VIEWS:\n"
@@ -293,98 +507,11 @@ def _build_pass2_system_prompt(object_type: Optional[str]) -> str:
         "\n"
     )
 
-        
-    procedure_rules = """
-    PROCEDURE RULES (Snowflake SQL language — strict, safe, non-inventive):
-
-    GENERAL STRUCTURE
-    - Output MUST start with:
-        CREATE OR REPLACE PROCEDURE <schema>.<name>(<args>)
-    - PARAMETERS:
-        • Remove all @ prefixes.
-        • Convert SQL Server types to Snowflake types:
-            NVARCHAR, VARCHAR, TEXT → STRING
-            INT → INT
-            BIGINT → NUMBER(38,0)
-            SMALLINT, TINYINT → NUMBER(3,0)
-            MONEY, SMALLMONEY → NUMBER(19,4)
-            BIT or flag types → BOOLEAN
-            DATETIME/DATETIME2 → TIMESTAMP
-        • If parameter name collides with a column, prefix with p_.
-    - IDENTIFIERS:
-        • Remove all [brackets].
-        • Always output schema.object, never [schema].[object].
-    - PARAMETER SHADOWING (CRITICAL RULE):
-    • If a parameter name is identical to any column referenced in the procedure (e.g., BusinessEntityID, Rate, HireDate), the parameter MUST be renamed automatically to p_<name>.
-    • After renaming, ALL references to that parameter inside the procedure body MUST use the prefixed name (p_<name>).
-    • NEVER allow expressions like: column = column. This is always invalid. Convert to: column = p_column.
-    • When in doubt, always prefix parameters with p_ to avoid accidental shadowing.
-
-    HEADER ORDER (REQUIRED)
-    After the signature, output these lines, each on its own line and in this order:
-        RETURNS <type>
-        LANGUAGE SQL
-        EXECUTE AS CALLER
-        AS
-
-    BODY RULES (MUST FOLLOW EXACTLY)
-    - Wrap the body with: $$ ... $$;
-    - Inside $$ ... $$ there MUST be ONLY:
-        1) Optional DECLARE section.
-        2) A single BEGIN ... EXCEPTION ... END block.
-    - DECLARE rules:
-        • DECLARE section MUST be omitted entirely if there are no variables.
-        • NEVER output DECLARE with no variables inside (invalid Snowflake syntax).
-    - BEGIN block rules:
-        • Only one BEGIN and one END.
-        • No nested BEGIN/END blocks.
-        • Must contain at least one RETURN.
-    - EXCEPTION block rules:
-        • EXCEPTION WHEN OTHER THEN <simple RETURN>;
-        • NO CALL statements unless the original procedure explicitly called an object with that exact name.
-        • NEVER invent log procedures, tables, or functions.
-        • NEVER add TODO comments or placeholder calls inside EXCEPTION.
-        • ONLY allowed action in EXCEPTION is: RETURN '<error message>'::STRING;
-    - Logic rules:
-        • Preserve UPDATE/INSERT/SELECT semantics.
-        • Remove all SQL Server-specific syntax.
-        • Do NOT rewrite or add extra logic not present in the original T-SQL.
-
-    STRICT PROHIBITIONS
-    - NEVER output:
-        • SQL Server CREATE PROCEDURE syntax.
-        • @variables or @assignments.
-        • SET NOCOUNT ON.
-        • TRY/CATCH blocks (convert them).
-        • BEGIN TRY, END TRY, BEGIN CATCH, END CATCH.
-        • BEGIN TRAN, COMMIT, ROLLBACK, @@TRANCOUNT.
-        • DECLARE after BEGIN.
-        • DECLARE with no variables.
-        • Any invented CALL, procedure, function or table.
-        • Any invented logging mechanism.
-        • Fallback comments like "/* original T-SQL */" or "TODO".
-
-    EXCEPTION TRANSLATION RULE
-    - Convert T-SQL TRY/CATCH to:
-        EXCEPTION WHEN OTHER THEN RETURN 'Error occurred'::STRING;
-    - Do not include any additional logic unless the original code had it AND the referenced object exists in the input.
-
-    RETURN RULE
-    - If the original procedure did not return a scalar value:
-        RETURN 'OK'::STRING;
-
-    VALIDITY REQUIREMENT
-    - The generated output MUST be valid Snowflake SQL syntax.
-    - If uncertain, simplify — do NOT invent objects or logic.
-    - Safety over completeness: omit features rather than generate invalid or imaginary ones.
-
-
-    """
-
     if otype == "view":
         return header + view_requirements + generic_requirements
     elif otype == "procedure":
-        return header + procedure_rules + generic_requirements
+        # Same leading rules block as pass1 (prompt-cache prefix)
+        return _PROMPT_ROLE + _PROCEDURE_RULES + header + generic_requirements
     else:
         hybrid = (
             "Object type is uncertain (could be VIEW or PROCEDURE).\n"
@@ -392,16 +519,68 @@ def _build_pass2_system_prompt(object_type: Optional[str]) -> str:
             "If it looks like a PROCEDURE, normalize it as a PROCEDURE.\n"
             "If still ambiguous, prefer VIEW and add '-- TODO:' clarifying the assumption.\n\n"
         )
-        return header + hybrid + view_requirements + procedure_requirements + generic_requirements
+        return _PROMPT_ROLE + _PROCEDURE_RULES + header + hybrid + view_requirements + generic_requirements
+
+
+# User prompts (str.format templates; kept here so prompt_signature sees every prompt text)
+_PASS1_USER_PROMPT = """Source object type: {object_type}.
+
+Use these Snowflake doc sections as your grounding (titles):
+{ctx_sections}
+
+Now translate the following to **Snowflake SQL only**. If unsure: add `-- TODO:` lines.
+
+---BEGIN SOURCE---
+{input_sql}
+---END SOURCE---"""
+
+_PASS2_USER_PROMPT = """Repair and normalize this draft for Snowflake:
+
+Guidance (JSON):
+{guide}
+
+---BEGIN DRAFT---
+{draft}
+---END DRAFT---
+
+Output Snowflake SQL only. If unsure about any fix, add `-- TODO:` and leave the original structure."""
+
+_COMBINED_USER_PROMPT = """Source object type: {object_type}.
+
+Use these Snowflake doc sections as your grounding (titles):
+{ctx_sections}
+
+T-SQL constructs detected in the source (fix each one):
+{hint_lines}
+
+Now translate the following to **Snowflake SQL only**. If unsure: add `-- TODO:` lines.
+
+---BEGIN SOURCE---
+{input_sql}
+---END SOURCE---"""
+
+_UNAVAILABLE_DRAFT = """-- TODO: Model unavailable; conservative pass-through. Review manually.
+{input_sql}"""
 
 
 # -------- Public API --------
+@functools.lru_cache(maxsize=1)
+def prompt_signature() -> str:
+    """SHA-1 over every prompt text and sampling setting; changes whenever the LLM would be asked differently."""
+    texts = [_pass1_system_prompt(t) for t in ("view", "procedure", "unknown")]
+    texts += [_pass2_system_prompt(t) for t in ("view", "procedure", "unknown")]
+    texts += [_SAFE_FIXES_RULES, _PASS1_USER_PROMPT, _PASS2_USER_PROMPT, _COMBINED_USER_PROMPT]
+    texts += [hint for _, hint in _STATIC_HINTS]
+    texts.append(f"temperature={LLM_TEMPERATURE} cap={MAX_TOKENS_CAP}")
+    return hashlib.sha1("\0".join(texts).encode("utf-8")).hexdigest()
+
 def pass1_translate(input_sql: str,
                     retrieved: Dict[str, Any],
                     object_type: Optional[str],
                     model: Optional[str] = None) -> Dict[str, Any]:
     """
-    -> {"draft_sql": "...", "citations": [...], "todos": [...], "notes": [...], "retrieval_weak": bool}
+    -> {"draft_sql": "...", "citations": [...], "todos": [...], "notes": [...], "retrieval_weak": bool,
+        "model_unavailable": bool}
     """
     logger = _get_logger()
     citations = _extract_citations(retrieved)
@@ -410,30 +589,22 @@ def pass1_translate(input_sql: str,
     system_prompt = _build_pass1_system_prompt(object_type)
 
     # Provide minimal context: list of relevant sections (titles only)
-    ctx_sections = "\n".join(f"- {c}" for c in citations) if citations else "- (no relevant sections)"
-
-    user_prompt = f"""Source object type: {object_type or 'unknown'}.
-
-Use these Snowflake doc sections as your grounding (titles):
-{ctx_sections}
-
-Now translate the following to **Snowflake SQL only**. If unsure: add `-- TODO:` lines.
+    ctx_sections = _format_citations_block(tuple(citations))
 
----BEGIN SOURCE---
-{input_sql}
----END SOURCE---"""
+    user_prompt = _PASS1_USER_PROMPT.format(
+        object_type=object_type or "unknown", ctx_sections=ctx_sections, input_sql=input_sql,
+    )
 
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
     # Try LLM; fall back to echo with TODO if unavailable
-    draft_sql = _llm_chat(
-        [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        model=model,
-    )
-    if not draft_sql:
-        draft_sql = f"""-- TODO: Model unavailable; conservative pass-through. Review manually.
-{input_sql}"""
+    # T-SQL -> Snowflake grows (headers, casts, $$ body): budget 2x the source
+    draft_sql = _llm_chat(messages, model=model, max_tokens=_max_tokens_for(input_sql, 2.0))
+    model_unavailable = not draft_sql
+    if model_unavailable:
+        draft_sql = _UNAVAILABLE_DRAFT.format(input_sql=input_sql)
 
     todos = _scan_todos(draft_sql)
     notes = ["conservative", "phase4-pass1"]
@@ -444,6 +615,7 @@ Now translate the following to **Snowflake SQL only**. If unsure: add `-- TODO:`
         "todos": todos,
         "notes": notes,
         "retrieval_weak": retrieval_weak,
+        "model_unavailable": model_unavailable,
     }
 
 def pass2_repair(draft_sql: str,
@@ -452,10 +624,11 @@ def pass2_repair(draft_sql: str,
                  object_type: Optional[str],
                  model: Optional[str] = None) -> Dict[str, Any]:
     """
-    -> {"final_sql": "...", "applied_fixes": [...], "remaining_todos": [...]}
+    -> {"final_sql": "...", "applied_fixes": [...], "remaining_todos": [...], "model_unavailable": bool}
     """
     logger = _get_logger()
     applied_fixes: List[str] = []
+    model_unavailable = False
 
     # 1) Apply small deterministic fixes (very conservative)
     repaired = _apply_safe_fixes(draft_sql, object_type, applied_fixes)
@@ -478,38 +651,85 @@ def pass2_repair(draft_sql: str,
             },
             "citations": citations,
         }
-        user_prompt = f"""Repair and normalize this draft for Snowflake:
-
-Guidance (JSON):
-{json.dumps(guide, indent=2)}
-
----BEGIN DRAFT---
-{repaired}
----END DRAFT---
-
-Output Snowflake SQL only. If unsure about any fix, add `-- TODO:` and leave the original structure."""
+        user_prompt = _PASS2_USER_PROMPT.format(guide=_compact_json(guide), draft=repaired)
         llm_out = _llm_chat(
             [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
             model=model,
+            max_tokens=_max_tokens_for(repaired, 1.5),  # a repair stays close to the draft's size
         )
         if llm_out:
             repaired = llm_out
+        else:
+            model_unavailable = True  # the draft goes out unrepaired
 
     # 3) Post-process formatting hygiene
-    repaired = repaired.strip()
-    # Ensure one terminal semicolon for single statements (best-effort; safe for views)
-    if object_type == "view":
-        repaired = _ensure_ends_with_semicolon(_strip_trailing_semicolons(repaired))
-
-    remaining_todos = _scan_todos(repaired)
+    repaired, remaining_todos = _analyze_sql(repaired, object_type)
     logger.info(f"pass2_repair: fixes={applied_fixes} todos_left={len(remaining_todos)}")
     return {
         "final_sql": repaired,
         "applied_fixes": applied_fixes,
         "remaining_todos": remaining_todos,
+        "model_unavailable": model_unavailable,
+    }
+
+def pass_combined(input_sql: str,
+                  retrieved: Dict[str, Any],
+                  object_type: Optional[str],
+                  model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    pass1 + pass2 in ONE LLM call: translate with the repair rules and hints from a
+    static scan of the source, then the same deterministic fixes/hygiene as pass2.
+    -> pass1 keys ("draft_sql", "citations", "todos", "notes", "retrieval_weak")
+       + pass2 keys ("final_sql", "applied_fixes", "remaining_todos") + "hints", "model_unavailable"
+    """
+    logger = _get_logger()
+    citations = _extract_citations(retrieved)
+    retrieval_weak = bool(retrieved.get("retrieval_weak", False))
+    hints = _static_hints(input_sql)
+
+    system_prompt = _build_pass1_system_prompt(object_type) + "\n" + _SAFE_FIXES_RULES
+    ctx_sections = _format_citations_block(tuple(citations))
+    hint_lines = "\n".join(f"- {h}" for h in hints) if hints else "- (none detected)"
+
+    user_prompt = _COMBINED_USER_PROMPT.format(
+        object_type=object_type or "unknown", ctx_sections=ctx_sections,
+        hint_lines=hint_lines, input_sql=input_sql,
+    )
+
+    draft_sql = _llm_chat(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        model=model,
+        max_tokens=_max_tokens_for(input_sql, 2.0),
+    )
+    model_unavailable = not draft_sql
+    if model_unavailable:
+        draft_sql = _UNAVAILABLE_DRAFT.format(input_sql=input_sql)
+    draft_sql = draft_sql.strip()
+    todos = _scan_todos(draft_sql)
+
+    applied_fixes: List[str] = []
+    final_sql, remaining_todos = _analyze_sql(
+        _apply_safe_fixes(draft_sql, object_type, applied_fixes), object_type,
+        None if applied_fixes else todos,
+    )
+    logger.info(f"pass_combined: citations={len(citations)} hints={len(hints)} fixes={applied_fixes} todos_left={len(remaining_todos)}")
+    return {
+        "draft_sql": draft_sql,
+        "citations": citations,
+        "todos": todos,
+        "notes": ["conservative", "phase4-combined"],
+        "retrieval_weak": retrieval_weak,
+        "hints": hints,
+        "final_sql": final_sql,
+        "applied_fixes": applied_fixes,
+        "remaining_todos": remaining_todos,
+        "model_unavailable": model_unavailable,
     }
 
 def prepend_summary(final_sql: str,
@@ -519,27 +739,10 @@ def prepend_summary(final_sql: str,
     """
     -> "<comment block>\\n<final snowflake sql>"
     """
-    lines: List[str] = []
-    lines.append("-- ===============================================")
-    lines.append("-- Translation summary (Phase 4)")
-    if citations:
-        lines.append("-- Citations:")
-        for c in citations:
-            lines.append(f"--   - {c}")
-    else:
-        lines.append("-- Citations: (none)")
-    if applied_fixes:
-        lines.append("-- Applied fixes:")
-        for f in applied_fixes:
-            lines.append(f"--   - {f}")
-    else:
-        lines.append("-- Applied fixes: (none)")
-    if todos:
-        lines.append("-- TODOs:")
-        for t in todos:
-            lines.append(f"--   {t}")
-    else:
-        lines.append("-- TODOs: (none)")
-    lines.append("-- ===============================================")
-    summary = "\n".join(lines)
-    return f"{summary}\n{final_sql.strip()}"
+    rule = "-- ==============================================="
+    lines = [rule, "-- Translation summary (Phase 4)"]
+    lines += ["-- Citations:", *(f"--   - {c}" for c in citations)] if citations else ["-- Citations: (none)"]
+    lines += ["-- Applied fixes:", *(f"--   - {f}" for f in applied_fixes)] if applied_fixes else ["-- Applied fixes: (none)"]
+    lines += ["-- TODOs:", *(f"--   {t}" for t in todos)] if todos else ["-- TODOs: (none)"]
+    lines += (rule, final_sql.strip())
+    return "\n".join(lines)
@@ -8,6 +8,7 @@ from __future__ import annotations
 import re
 import sys
 import json
+import functools
 import logging
 from pathlib import Path
 from typing import Dict, Any, List
@@ -16,9 +17,10 @@ from typing import Dict, Any, List
 LOG_FILE = r"C:\Users\CatherineVaras\Downloads\tsql-to-snowflake-llm-rag-translator\project\logs\validator.log"
 
 # ---------- Logger ----------
+@functools.lru_cache(maxsize=1)
 def _get_logger() -> logging.Logger:
     logger = logging.getLogger("validator_phase4")
-    if getattr(logger, "_configured", False):
+    if getattr(logger, "_configured", False):  # handlers survive a module reload
         return logger
     logger.setLevel(logging.DEBUG)
     log_path = Path(LOG_FILE)
@@ -43,15 +45,19 @@ _SQ_RE            = re.compile(r"'(?:''|[^'])*'", re.DOTALL)
 # dollar-quoted blocks: $$ ... $$
 _DOLLAR_RE        = re.compile(r"\$\$.*?\$\$", re.DOTALL | re.IGNORECASE)
 
+# Each pass only runs when its marker is present: a regex can't match without
+# its literal, and clean drafts skip all four traversals.
 def _strip_comments(sql: str) -> str:
-    s = _COMMENT_BLOCK_RE.sub(" ", sql)
-    s = _COMMENT_LINE_RE.sub(" ", s)
+    s = _COMMENT_BLOCK_RE.sub(" ", sql) if "/*" in sql else sql
+    if "--" in s:
+        s = _COMMENT_LINE_RE.sub(" ", s)
     return s
 
 def _mask_strings(sql: str) -> str:
-    s = _SQ_RE.sub(" '' ", sql)
+    s = _SQ_RE.sub(" '' ", sql) if "'" in sql else sql
     # keep $$ markers presence detectable but mask content
-    s = _DOLLAR_RE.sub(" $$ $$ ", s)
+    if "$$" in s:
+        s = _DOLLAR_RE.sub(" $$ $$ ", s)
     return s
 
 def _prep(sql: str) -> str:
@@ -61,8 +67,42 @@ def _prep(sql: str) -> str:
 def _add(lst: List[Dict[str, str]], code: str, msg: str) -> None:
     lst.append({"code": code, "msg": msg})
 
-def _has(pattern: str, s: str, flags=re.IGNORECASE) -> bool:
-    return re.search(pattern, s, flags) is not None
+# ---------- Detection tokens (one fused scan) ----------
+# No two tokens can match at the same spot, and none consumes the start of
+# another, so a single finditer pass sees every token a separate search would.
+_TOKENS = {
+    "TOP":         r"TOP\s+\d+\b",
+    "BEGIN":       r"BEGIN\b",
+    "END":         r"END\b",
+    "OVER":        r"OVER\s*\(",
+    "QUALIFY":     r"QUALIFY\b",
+    "GETDATE":     r"(?:GETDATE|GETUTCDATE|CURRENT_TIMESTAMP)\s*\(",
+    "PROC_TOKENS": r"(?:DECLARE|RETURN|RAISERROR|TRY|CATCH)\b",
+    "AS_DOLLARS":  r"AS\s*\$\$\b",
+    "LANG_SQL":    r"LANGUAGE\s+SQL\b",
+    "LANG_JS":     r"LANGUAGE\s+JAVASCRIPT\b",
+    "JS_TOKENS":   r"(?:var|let|const|function)\b",
+    "SQL_TOKENS":  r"(?:SELECT|INSERT|UPDATE|DELETE|MERGE|WITH)\b",
+    "RETURNS":     r"RETURNS\b(?=\s+[A-Z_])",  # lookahead: the type name may itself be a token
+    "IF":          r"IF\b",
+    "WHILE":       r"WHILE\b",
+    "LOOP":        r"LOOP\b",
+}
+# Every token starts a word: the shared \b + letter check lets the scan skip all
+# other positions before trying the alternatives.
+_SCANNER = re.compile(
+    r"\b(?=[A-Z])(?:" + "|".join(f"(?P<{k}>{pat})" for k, pat in _TOKENS.items()) + ")",
+    re.IGNORECASE,
+)
+
+def _scan_tokens(cleaned: str) -> set:
+    """Names of the _TOKENS present in `cleaned`, from a single pass."""
+    found = set()
+    for m in _SCANNER.finditer(cleaned):
+        found.add(m.lastgroup)
+        if len(found) == len(_TOKENS):
+            break
+    return found
 
 # ---------- Core validation ----------
 def make_signals(sql: str, object_type: str | None) -> Dict[str, Any]:
@@ -87,18 +127,19 @@ def make_signals(sql: str, object_type: str | None) -> Dict[str, Any]:
         # --------------------
         # Common detections
         # --------------------
-        has_top          = _has(r"\bTOP\s+\d+\b", cleaned)
-        has_begin        = _has(r"\bBEGIN\b", cleaned)
-        has_end          = _has(r"\bEND\b", cleaned)
-        has_over         = _has(r"\bOVER\s*\(", cleaned)
-        has_qualify      = _has(r"\bQUALIFY\b", cleaned)
-        has_getdate_like = _has(r"\b(GETDATE|GETUTCDATE|CURRENT_TIMESTAMP)\s*\(", cleaned)
-        has_proc_tokens  = _has(r"\b(DECLARE|RETURN|RAISERROR|TRY|CATCH)\b", cleaned)
-        has_dollars_as   = _has(r"\bAS\s*\$\$\b", cleaned) and _has(r"\$\$", cleaned)
-        has_language_sql = _has(r"\bLANGUAGE\s+SQL\b", cleaned)
-        has_language_js  = _has(r"\bLANGUAGE\s+JAVASCRIPT\b", cleaned)
-        has_js_tokens    = _has(r"\b(var|let|const|function)\b", cleaned)
-        has_sql_tokens   = _has(r"\b(SELECT|INSERT|UPDATE|DELETE|MERGE|WITH)\b", cleaned)
+        found = _scan_tokens(cleaned)
+        has_top          = "TOP" in found
+        has_begin        = "BEGIN" in found
+        has_end          = "END" in found
+        has_over         = "OVER" in found
+        has_qualify      = "QUALIFY" in found
+        has_getdate_like = "GETDATE" in found
+        has_proc_tokens  = "PROC_TOKENS" in found
+        has_dollars_as   = "AS_DOLLARS" in found  # AS $$ implies a $$
+        has_language_sql = "LANG_SQL" in found
+        has_language_js  = "LANG_JS" in found
+        has_js_tokens    = "JS_TOKENS" in found
+        has_sql_tokens   = "SQL_TOKENS" in found
 
         # --------------------
         # VIEW checks
@@ -120,7 +161,7 @@ def make_signals(sql: str, object_type: str | None) -> Dict[str, Any]:
         # --------------------
         if otype == "procedure":
             # Snowflake requires RETURNS <type>
-            if not _has(r"\bRETURNS\b\s+[A-Z_][A-Z0-9_]*", cleaned):
+            if "RETURNS" not in found:
                 _add(errors, "MISSING_RETURNS", "Snowflake PROCEDURE must declare RETURNS <type> (e.g., RETURNS STRING).")
             # Body delimiter AS $$ ... $$ (common style, esp. with LANGUAGE SQL/JS)
             if not has_dollars_as:
@@ -131,9 +172,9 @@ def make_signals(sql: str, object_type: str | None) -> Dict[str, Any]:
             if has_language_sql and has_js_tokens:
                 _add(warnings, "LANGUAGE_MISMATCH", "LANGUAGE SQL declared but body contains JavaScript-like tokens.")
             # Control-flow without clear scoping (heuristic)
-            has_if     = _has(r"\bIF\b", cleaned)
-            has_while  = _has(r"\bWHILE\b", cleaned)
-            has_loop   = _has(r"\bLOOP\b", cleaned)
+            has_if     = "IF" in found
+            has_while  = "WHILE" in found
+            has_loop   = "LOOP" in found
             if (has_if or has_while or has_loop) and not (has_begin and has_end) and not has_language_js:
                 _add(warnings, "UNSCOPED_CONTROL", "Control-flow tokens found without BEGIN...END block (Snowflake SQL Scripting) or JS function scope.")
 